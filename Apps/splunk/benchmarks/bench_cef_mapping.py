@@ -0,0 +1,128 @@
+# File: bench_cef_mapping.py
+# Copyright (c) 2014-2020 Splunk Inc.
+#
+# SPLUNK CONFIDENTIAL - Use or disclosure of this material in whole or in part
+# without a valid written license from Splunk Inc. is PROHIBITED.
+# --
+
+"""Compare the per-row CIM to CEF mapping that on poll used to do with the compiled CEFMappingPlan
+
+Both paths build the artifact CEF dictionary and the container name of each synthetic
+result, once mapping every field and once with a list of display fields.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import splunk_consts as consts  # noqa
+from splunk_utils import CEFMappingPlan  # noqa
+
+DISPLAY = 'src_ip, dest_ip, Dest_Port, user, action, app, message, host'
+
+
+def synthetic_rows(rows, fields):
+    for i in range(rows):
+        row = {
+            '_time': '2020-02-24T22:32:{0:02d}.000+00:00'.format(i % 60),
+            '_indextime': str(1582583550 + i),
+            '_raw': 'Feb 24 22:32:30 fw-{0:02d} action=allowed src_ip=10.0.{1}.{2}'.format(i % 50, i % 256, (i * 7) % 256),
+            'host': 'fw-{0:02d}'.format(i % 50),
+            'source': '/var/log/firewall',
+            'sourcetype': 'firewall',
+            'src_ip': '10.0.{0}.{1}'.format(i % 256, (i * 7) % 256),
+            'dest_ip': '192.168.{0}.{1}'.format(i % 256, (i * 3) % 256),
+            'Dest_Port': str(i % 65536),
+            'user': 'user{0}'.format(i % 100),
+            'action': 'allowed',
+            'app': 'ssh',
+        }
+        for f in range(fields - len(row)):
+            row['field_{0}'.format(f)] = 'value_{0}_{1}'.format(f, i % 1000)
+        yield row
+
+
+def legacy_title(item, prefix, name_values):
+    # _get_splunk_title before the mapping plan
+    title = prefix
+    if not title and not name_values:
+        name_values.append('source')
+
+    values = ''
+    for i in range(len(name_values)):
+        value = item.get(consts.CIM_CEF_MAP.get(name_values[i], name_values[i]))
+        if value:
+            values += "{}{}".format(value, '' if i == len(name_values) - 1 else ', ')
+
+    if not title:
+        time = item.get('_time')
+        if time:
+            title = "Splunk Log Entry on {}".format(time)
+        else:
+            title = "Splunk Log Entry"
+    else:
+        title = item.get(title, title)
+
+    return "{}: {}".format(title, values)
+
+
+def legacy(data, display, prefix, name_values):
+    # The per-row loop of _on_poll before the mapping plan
+    header_set = None
+    if display:
+        header_set = {x.strip().lower() for x in display.split(',')}
+
+    mapped = []
+    for item in data:
+        cef = {}
+        if header_set:
+            name_mappings = {}
+            for k, v in list(item.items()):
+                if k.lower() in header_set:
+                    name_mappings[k.lower()] = k
+            for h in header_set:
+                cef[name_mappings.get(consts.CIM_CEF_MAP.get(h, h), h)] = item.get(name_mappings.get(h, h))
+        else:
+            for k, v in list(item.items()):
+                cef[consts.CIM_CEF_MAP.get(k, k)] = v
+        mapped.append((cef, legacy_title(item, prefix, name_values)))
+    return mapped
+
+
+def planned(data, display, prefix, name_values):
+    fields = set()
+    for item in data:
+        fields.update(item)
+    plan = CEFMappingPlan(consts.CIM_CEF_MAP, fields, display.split(',') if display else None, prefix, name_values)
+    return [(plan.cef(item), plan.name(item)) for item in data]
+
+
+def bench(name, mapper, data, display, prefix, name_values):
+    start = time.time()
+    mapped = mapper(data, display, prefix, list(name_values))
+    elapsed = time.time() - start
+    print('{0:<28} {1:>9} rows  {2:7.3f}s  {3:>10.0f} rows/s'.format(name, len(mapped), elapsed, len(mapped) / elapsed))
+    return mapped, elapsed
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument('--rows', type=int, default=100000, help='Number of synthetic results (default: 100000)')
+    argparser.add_argument('--fields', type=int, default=30, help='Number of fields per synthetic result (default: 30)')
+    args = argparser.parse_args()
+
+    data = list(synthetic_rows(args.rows, args.fields))
+
+    for label, display, prefix, name_values in (('all fields', None, '', []),
+                                                ('display fields', DISPLAY, 'Firewall Event', ['src_ip', 'dest_ip'])):
+        before, before_time = bench('before, {0}'.format(label), legacy, data, display, prefix, name_values)
+        after, after_time = bench('after, {0}'.format(label), planned, data, display, prefix, name_values)
+        assert before == after, 'The mapping plan does not produce the same artifacts and names'
+        print('speedup: {0:.1f}x\n'.format(before_time / after_time))
+
+
+if __name__ == '__main__':
+    main()
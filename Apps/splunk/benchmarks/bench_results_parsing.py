@@ -0,0 +1,132 @@
+# File: bench_results_parsing.py
+# Copyright (c) 2014-2020 Splunk Inc.
+#
+# SPLUNK CONFIDENTIAL - Use or disclosure of this material in whole or in part
+# without a valid written license from Splunk Inc. is PROHIBITED.
+# --
+
+"""Compare the XML (splunklib ResultsReader) and JSON (JSONResultsReader) result parsing paths
+
+Recorded payloads can be captured from a Splunk instance with:
+
+    curl -k -u admin -o results.xml "https://<host>:8089/services/search/jobs/<sid>/results?count=0&output_mode=xml"
+    curl -k -u admin -o results.json "https://<host>:8089/services/search/jobs/<sid>/results?count=0&output_mode=json"
+
+and passed with --xml/--json. Without them, synthetic payloads of --rows results are generated.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from io import BytesIO
+from xml.sax.saxutils import escape, quoteattr
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+try:
+    import splunklib.results as splunk_results
+except ImportError:
+    # Fall back to the SDK wheel shipped with the app
+    sys.path.extend(glob.glob(os.path.join(APP_DIR, 'splunk_sdk_wheel', '*-py3-none-any.whl')))
+    import splunklib.results as splunk_results
+
+from splunk_utils import JSONResultsReader  # noqa
+
+
+def synthetic_rows(rows, fields):
+    for i in range(rows):
+        row = {
+            '_time': '2020-02-24T22:32:{0:02d}.000+00:00'.format(i % 60),
+            '_indextime': str(1582583550 + i),
+            '_raw': 'Feb 24 22:32:30 web-{0:02d} sshd[{1}]: Accepted publickey for user{2} from 10.0.{3}.{4} port 22'.format(
+                i % 50, 1000 + i, i % 100, i % 256, (i * 7) % 256),
+            'host': 'web-{0:02d}'.format(i % 50),
+            'source': '/var/log/secure',
+            'sourcetype': 'linux_secure',
+        }
+        for f in range(fields - len(row)):
+            row['field_{0}'.format(f)] = 'value_{0}_{1}'.format(f, i % 1000)
+        yield row
+
+
+def to_xml(rows):
+    rows = list(rows)
+    parts = ["<?xml version='1.0' encoding='UTF-8'?>\n<results preview='0'>\n<meta>\n<fieldOrder>\n"]
+    parts.extend('<field>{0}</field>\n'.format(escape(k)) for k in rows[0])
+    parts.append('</fieldOrder>\n</meta>\n')
+    for offset, row in enumerate(rows):
+        parts.append("<result offset='{0}'>\n".format(offset))
+        for k, v in row.items():
+            if k == '_raw':
+                parts.append("\t<field k='_raw'><v xml:space='preserve' trunc='0'>{0}</v></field>\n".format(escape(v)))
+            else:
+                parts.append("\t<field k={0}>\n\t\t<value><text>{1}</text></value>\n\t</field>\n".format(quoteattr(k), escape(v)))
+        parts.append('</result>\n')
+    parts.append('</results>\n')
+    return ''.join(parts).encode('utf-8')
+
+
+def to_json(rows):
+    rows = list(rows)
+    document = {
+        'preview': False,
+        'init_offset': 0,
+        'messages': [],
+        'fields': [{'name': k} for k in rows[0]],
+        'results': rows
+    }
+    return json.dumps(document, separators=(',', ':')).encode('utf-8')
+
+
+def parse_xml(payload):
+    return sum(1 for result in splunk_results.ResultsReader(BytesIO(payload)) if isinstance(result, dict))
+
+
+def parse_json(payload):
+    return sum(1 for _ in JSONResultsReader(BytesIO(payload)))
+
+
+def bench(name, parse, payload, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        rows = parse(payload)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('{0:<5} {1:>9} rows  {2:>8.1f} KiB  best of {3}: {4:7.3f}s  {5:>10.0f} rows/s'.format(
+        name, rows, len(payload) / 1024.0, repeat, best, rows / best))
+    return best
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--rows', type=int, default=100000, help='Number of synthetic results (default: 100000)')
+    argparser.add_argument('--fields', type=int, default=20, help='Number of fields per synthetic result (default: 20)')
+    argparser.add_argument('--xml', help='Recorded results payload in XML')
+    argparser.add_argument('--json', help='Recorded results payload in JSON')
+    argparser.add_argument('--repeat', type=int, default=1, help='Number of runs per parser (default: 1)')
+    args = argparser.parse_args()
+
+    if bool(args.xml) != bool(args.json):
+        argparser.error('--xml and --json must be given together')
+
+    if args.xml:
+        with open(args.xml, 'rb') as f:
+            xml_payload = f.read()
+        with open(args.json, 'rb') as f:
+            json_payload = f.read()
+    else:
+        xml_payload = to_xml(synthetic_rows(args.rows, args.fields))
+        json_payload = to_json(synthetic_rows(args.rows, args.fields))
+
+    xml_time = bench('xml', parse_xml, xml_payload, args.repeat)
+    json_time = bench('json', parse_json, json_payload, args.repeat)
+    print('json speedup: {0:.1f}x'.format(xml_time / json_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,17 +9,21 @@
 import phantom.app as phantom
 from phantom.base_connector import BaseConnector
 from phantom.action_result import ActionResult
+from phantom.vault import Vault
 
 # THIS Connector imports
 import splunk_consts as consts
+from splunk_utils import (RETRYABLE_STATUSES, BoundedSeenSet, CEFMappingPlan, CircuitBreaker, JobWaiter, JSONLinesSpill, JSONResultsReader,
+                          KVStoreSnapshot, ResultBudget, RetryPolicy, gzip_compress, is_retryable_error, iter_batches, normalize_search_query)
 
 from splunklib.binding import HTTPError
 import splunklib.client as splunk_client
-import splunklib.results as splunk_results
 
+import os
 import re
 import time
 import pytz
+import tempfile
 import hashlib
 import requests
 import simplejson as json
@@ -31,11 +35,16 @@ from bs4 import BeautifulSoup
 import ssl
 from io import BytesIO
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from itertools import islice
 
 # Python2 - Python3 compatibility imports
 from future.standard_library import install_aliases
 install_aliases()
 
+import queue  # noqa
 from urllib.parse import urlparse, urlencode  # noqa
 from urllib.error import HTTPError as UrllibHTTPError  # noqa
 
@@ -59,19 +68,27 @@ class SplunkConnector(BaseConnector):
     ACTION_ID_RUN_QUERY = "execute_search"
     ACTION_ID_UPDATE_EVENT = "update_event"
     ACTION_ID_GET_HOST_EVENTS = "get_host_events"
+    ACTION_ID_RUN_BATCH_QUERY = "run_batch_query"
 
     def __init__(self):
 
         # Call the BaseConnectors init first
         super(SplunkConnector, self).__init__()
         self._service = None
+        self._session = None
+        self._session_lock = threading.Lock()
         self._base_url = None
+        # Held by every change of the state dict, which worker threads of an action run may make concurrently
+        self._state_lock = threading.RLock()
+        self._job_reuse_lock = threading.Lock()
+        self._job_reuse_locks = {}
+        self._search_jobs = {}
 
-    def _validate_numeric_parameter(self, value):
+    def _validate_numeric_parameter(self, value, allow_zero=False):
         try:
             if value:
                 value = int(value)
-            if value == 0 or (value and (not str(value).isdigit() or value <= 0)):
+            if (value == 0 and not allow_zero) or (value and (not str(value).isdigit() or value <= 0)):
                 return phantom.APP_ERROR
         except:
             return phantom.APP_ERROR
@@ -118,6 +135,7 @@ class SplunkConnector(BaseConnector):
         if phantom.is_fail(ret_val):
             self.set_status(phantom.APP_ERROR, "Please provide non-zero positive integer in the 'Number of retries' asset configuration parameter")
             return phantom.APP_ERROR
+        self._retry_policy = RetryPolicy(int(retry_count or consts.SPLUNK_DEFAULT_RETRY_COUNT), consts.SPLUNK_RETRY_INITIAL_DELAY, consts.SPLUNK_RETRY_MAX_DELAY)
 
         # Validate port
         port = config.get('port')
@@ -133,11 +151,184 @@ class SplunkConnector(BaseConnector):
             self.set_status(phantom.APP_ERROR, "Please provide non-zero positive integer in the 'Max events to ingest (Default: 100)' asset configuration parameter")
             return phantom.APP_ERROR
 
+        # Validate the search job polling parameters
+        job_poll_max_interval = config.get('job_poll_max_interval')
+        ret_val = self._validate_numeric_parameter(job_poll_max_interval)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide non-zero positive integer in the 'Maximum seconds between search job status checks' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._job_poll_max_interval = int(job_poll_max_interval or consts.SPLUNK_DEFAULT_JOB_POLL_MAX_INTERVAL)
+
+        job_max_wait = config.get('job_max_wait')
+        ret_val = self._validate_numeric_parameter(job_max_wait, allow_zero=True)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide a positive integer in the 'Maximum seconds to wait for a search job to finish' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._job_max_wait = int(job_max_wait or consts.SPLUNK_DEFAULT_JOB_MAX_WAIT)
+
+        job_reuse_ttl = config.get('job_reuse_ttl')
+        ret_val = self._validate_numeric_parameter(job_reuse_ttl, allow_zero=True)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide a positive integer in the 'Seconds the search job of a query is reused by identical queries' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._job_reuse_ttl = int(job_reuse_ttl or 0)
+
+        job_ttl = config.get('job_ttl')
+        ret_val = self._validate_numeric_parameter(job_ttl)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide non-zero positive integer in the 'Seconds Splunk keeps a finished search job' asset configuration parameter")
+            return phantom.APP_ERROR
+        # A job must outlive the window in which identical queries may still reuse it
+        self._job_ttl = max(int(job_ttl or consts.SPLUNK_DEFAULT_JOB_TTL), self._job_reuse_ttl)
+        self._finalize_on_timeout = config.get('finalize_on_timeout', True)
+
+        # Validate the run query result budget
+        max_result_rows = config.get('max_result_rows')
+        ret_val = self._validate_numeric_parameter(max_result_rows, allow_zero=True)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide a positive integer in the 'Maximum number of results returned by run query' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._max_result_rows = int(max_result_rows or 0)
+
+        max_result_bytes = config.get('max_result_bytes')
+        ret_val = self._validate_numeric_parameter(max_result_bytes, allow_zero=True)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide a positive integer in the 'Maximum size in bytes of the results returned by run query' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._max_result_bytes = int(max_result_bytes or 0)
+
+        vault_result_rows = config.get('vault_result_rows')
+        ret_val = self._validate_numeric_parameter(vault_result_rows, allow_zero=True)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide a positive integer in the 'Number of results above which run query and get host events write them to a vault file' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._vault_result_rows = int(vault_result_rows or 0)
+
+        # Validate connection_pool_size
+        connection_pool_size = config.get('connection_pool_size')
+        ret_val = self._validate_numeric_parameter(connection_pool_size)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide non-zero positive integer in the 'Maximum number of pooled connections to the Splunk server' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._connection_pool_size = int(connection_pool_size or consts.SPLUNK_DEFAULT_CONNECTION_POOL_SIZE)
+
+        result_fetch_concurrency = config.get('result_fetch_concurrency')
+        ret_val = self._validate_numeric_parameter(result_fetch_concurrency)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide non-zero positive integer in the 'Number of result pages of a done search job downloaded at the same time' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._result_fetch_concurrency = int(result_fetch_concurrency or consts.SPLUNK_DEFAULT_RESULT_FETCH_CONCURRENCY)
+
+        # Validate ingest_batch_size
+        ingest_batch_size = config.get('ingest_batch_size')
+        ret_val = self._validate_numeric_parameter(ingest_batch_size)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide non-zero positive integer in the 'Number of containers saved at once during ingestion' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._ingest_batch_size = int(ingest_batch_size or consts.SPLUNK_DEFAULT_INGEST_BATCH_SIZE)
+
+        # Validate dedupe_index_size
+        dedupe_index_size = config.get('dedupe_index_size', consts.SPLUNK_DEFAULT_DEDUPE_INDEX_SIZE)
+        ret_val = self._validate_numeric_parameter(dedupe_index_size, allow_zero=True)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide a positive integer in the 'Number of ingested events remembered to skip duplicates' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._dedupe_index_size = int(dedupe_index_size or 0)
+
+        # Validate the backfill parameters
+        backfill_slice_seconds = config.get('backfill_slice_seconds', consts.SPLUNK_DEFAULT_BACKFILL_SLICE_SECONDS)
+        ret_val = self._validate_numeric_parameter(backfill_slice_seconds, allow_zero=True)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide a positive integer in the 'Size in seconds of the index time slices used to backfill' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._backfill_slice_seconds = int(backfill_slice_seconds or 0)
+
+        backfill_concurrency = config.get('backfill_concurrency')
+        ret_val = self._validate_numeric_parameter(backfill_concurrency)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide non-zero positive integer in the 'Number of backfill slices searched at the same time' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._backfill_concurrency = int(backfill_concurrency or consts.SPLUNK_DEFAULT_BACKFILL_CONCURRENCY)
+
+        self._on_poll_pipeline = config.get('on_poll_pipeline', False)
+
+        # Validate the HTTP Event Collector parameters
+        hec_port = config.get('hec_port')
+        ret_val = self._validate_numeric_parameter(hec_port)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide non-zero positive integer in the 'HTTP Event Collector port' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._hec_port = int(hec_port or consts.SPLUNK_DEFAULT_HEC_PORT)
+
+        hec_batch_size = config.get('hec_batch_size')
+        ret_val = self._validate_numeric_parameter(hec_batch_size)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide non-zero positive integer in the 'Maximum number of events sent to the HTTP Event Collector at once' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._hec_batch_size = int(hec_batch_size or consts.SPLUNK_DEFAULT_HEC_BATCH_SIZE)
+
+        hec_batch_bytes = config.get('hec_batch_bytes')
+        ret_val = self._validate_numeric_parameter(hec_batch_bytes)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide non-zero positive integer in the 'Maximum uncompressed size in bytes of the events sent to the HTTP Event Collector at once' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._hec_batch_bytes = int(hec_batch_bytes or consts.SPLUNK_DEFAULT_HEC_BATCH_BYTES)
+
+        # Validate the KV store bulk write parameters
+        kvstore_batch_size = config.get('kvstore_batch_size')
+        ret_val = self._validate_numeric_parameter(kvstore_batch_size)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide non-zero positive integer in the 'Maximum number of records saved to the KV store at once' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._kvstore_batch_size = int(kvstore_batch_size or consts.SPLUNK_DEFAULT_KVSTORE_BATCH_SIZE)
+
+        kvstore_batch_bytes = config.get('kvstore_batch_bytes')
+        ret_val = self._validate_numeric_parameter(kvstore_batch_bytes)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide non-zero positive integer in the 'Maximum size in bytes of the records saved to the KV store at once' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._kvstore_batch_bytes = int(kvstore_batch_bytes or consts.SPLUNK_DEFAULT_KVSTORE_BATCH_BYTES)
+
+        kvstore_concurrency = config.get('kvstore_concurrency')
+        ret_val = self._validate_numeric_parameter(kvstore_concurrency)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide non-zero positive integer in the 'Number of KV store batches saved at the same time' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._kvstore_concurrency = int(kvstore_concurrency or consts.SPLUNK_DEFAULT_KVSTORE_CONCURRENCY)
+
+        kvstore_snapshot_ttl = config.get('kvstore_snapshot_ttl', consts.SPLUNK_DEFAULT_KVSTORE_SNAPSHOT_TTL)
+        ret_val = self._validate_numeric_parameter(kvstore_snapshot_ttl, allow_zero=True)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide a positive integer in the 'Seconds a local KV store snapshot is used before being refreshed' asset configuration parameter")
+            return phantom.APP_ERROR
+        self._kvstore_snapshot_ttl = int(kvstore_snapshot_ttl or 0)
+
+        circuit_breaker_threshold = config.get('circuit_breaker_threshold', consts.SPLUNK_DEFAULT_CIRCUIT_BREAKER_THRESHOLD)
+        ret_val = self._validate_numeric_parameter(circuit_breaker_threshold, allow_zero=True)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide a positive integer in the 'Failed calls in a row after which calls to Splunk are paused' asset configuration parameter")
+            return phantom.APP_ERROR
+
+        circuit_breaker_reset = config.get('circuit_breaker_reset')
+        ret_val = self._validate_numeric_parameter(circuit_breaker_reset)
+        if phantom.is_fail(ret_val):
+            self.set_status(phantom.APP_ERROR, "Please provide non-zero positive integer in the 'Seconds calls to Splunk are paused for' asset configuration parameter")
+            return phantom.APP_ERROR
+
+        # The breaker works on the state file, so that the following action runs of the asset fail fast too
+        self._circuit_breaker = CircuitBreaker(self._state.setdefault('circuit_breaker', {}), int(circuit_breaker_threshold or 0),
+                int(circuit_breaker_reset or consts.SPLUNK_DEFAULT_CIRCUIT_BREAKER_RESET), lock=self._state_lock)
+
         return phantom.APP_SUCCESS
 
     def finalize(self):
+        if self._session is not None:
+            self._session.close()
         if self._state is not None:
-            self.save_state(self._state)
+            with self._state_lock:
+                # The session key may have been renewed by an automatic login during this run
+                self._cache_session_key()
+                self.save_state(self._state)
         return phantom.APP_SUCCESS
 
     def request(self, url, message, **kwargs):
@@ -174,6 +365,47 @@ class SplunkConnector(BaseConnector):
         install_opener(opener)
         return self.request
 
+    def _get_config_fingerprint(self):
+        """Digest of the asset settings that the cached session key depends on
+
+        The password is left out, so that the state file gives nothing to guess it from offline. A cached
+        session key that a password change made invalid is rejected with a 401, which logs in again.
+        """
+
+        config = self.get_config()
+        fingerprint = '|'.join(str(config.get(key, '')) for key in ('device', 'port', 'username', 'splunk_owner', 'splunk_app'))
+
+        return hashlib.sha256(fingerprint.encode('UTF-8')).hexdigest()
+
+    def _get_cached_session_key(self):
+        """Return the session key saved by a previous action run, if it is still usable"""
+
+        cached = self._state.get('session_key')
+        if not isinstance(cached, dict):
+            return None
+
+        if cached.get('fingerprint') != self._get_config_fingerprint() or cached.get('expires_at', 0) <= time.time():
+            with self._state_lock:
+                self._state.pop('session_key', None)
+            return None
+
+        return cached.get('token')
+
+    def _cache_session_key(self):
+        """Save the session key of the current connection for the next action runs"""
+
+        token = self._service.token if self._service is not None else None
+        if not isinstance(token, str):
+            return
+
+        # Every request made with the key restarts the session timeout on the Splunk side
+        with self._state_lock:
+            self._state['session_key'] = {
+                'token': token,
+                'expires_at': time.time() + consts.SPLUNK_SESSION_KEY_TTL,
+                'fingerprint': self._get_config_fingerprint()
+            }
+
     def _connect(self):
 
         if (self._service is not None):
@@ -184,13 +416,15 @@ class SplunkConnector(BaseConnector):
         splunk_server = config['device']
         username = config.get('username', None)
 
+        # With autologin, a request rejected with a 401 (expired session key) logs in again and is retried
         kwargs_config_flags = {
                 'host': splunk_server,
                 'port': int(config.get('port', 8089)),
                 'username': username,
                 'password': config.get('password', None),
                 'owner': config.get('splunk_owner', None),
-                'app': config.get('splunk_app', None)}
+                'app': config.get('splunk_app', None),
+                'autologin': True}
 
         self.save_progress(phantom.APP_PROG_CONNECTING_TO_ELLIPSES, splunk_server)
 
@@ -201,32 +435,83 @@ class SplunkConnector(BaseConnector):
         if self._proxy.get('https', None) is not None:
             proxy_param = self._proxy.get('https')
 
+        if proxy_param:
+            self.save_progress("[-] Engaging Proxy")
+            kwargs_config_flags['handler'] = self.handler(proxy_param)
+
+        session_key = self._get_cached_session_key()
+
         try:
-            if proxy_param:
-                self.save_progress("[-] Engaging Proxy")
-                self._service = splunk_client.connect(handler=self.handler(proxy_param), **kwargs_config_flags)
+            if session_key:
+                self.debug_print("Reusing the cached session key")
+                self._service = splunk_client.Service(token=session_key, **kwargs_config_flags)
             else:
-                self._service = splunk_client.connect(**kwargs_config_flags)
+                self._service = self._call_splunk(splunk_client.connect, **kwargs_config_flags)
         except Exception as e:
             return self.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_CONNECTION_FAILED, e)
 
+        self._cache_session_key()
+
         # Must return success if we want handle_action to be called
         return phantom.APP_SUCCESS
 
-    def _make_rest_call_retry(self, action_result, endpoint, data, params=None, method=requests.post):
-        if params is None:
-            params = {}
+    def _get_session(self):
+        """Return the keep-alive session that is shared by all the REST calls of this action run"""
+
+        # Worker threads of the action run may ask for it at the same time, only one session may be created
+        with self._session_lock:
+            if self._session is None:
+                adapter = requests.adapters.HTTPAdapter(pool_maxsize=self._connection_pool_size, pool_block=True)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+
+        return self._session
+
+    def _call_splunk(self, func, *args, **kwargs):
+        """Call the Splunk server through the retry policy and the circuit breaker of the asset
+
+        Only errors that retrying could have fixed count against the server, a rejected request
+        shows that the server is up. Raises CircuitOpenError without calling while the circuit is open.
+        """
+
+        self._circuit_breaker.check()
+
+        try:
+            result = self._retry_policy.call(func, *args, **kwargs)
+        except Exception as e:
+            if is_retryable_error(e):
+                self._circuit_breaker.record_failure()
+            else:
+                self._circuit_breaker.record_success()
+            raise
+
+        self._circuit_breaker.record_success()
+        return result
+
+    def _send_request(self, method, url, **kwargs):
+        """Send a request over the pooled session through _call_splunk
 
-        RETRY_LIMIT = int(self.get_config().get('retry_count', 3))
+        A response with a retryable status is retried like a connection error. Once the attempts
+        run out it is returned all the same, for the caller to report.
+        """
 
-        for _ in range(0, RETRY_LIMIT):
-            ret_val, resp_data = self._make_rest_call(action_result, endpoint, data, params, method)
+        def send():
+            response = self._get_session().request(method, url, **kwargs)
+            if response.status_code in RETRYABLE_STATUSES:
+                raise requests.HTTPError("{0} response from the server".format(response.status_code), response=response)
+            return response
 
-            if not phantom.is_fail(ret_val):
-                break
-        return ret_val, resp_data
+        try:
+            return self._call_splunk(send)
+        except requests.HTTPError as e:
+            if e.response is None:
+                raise
+            return e.response
 
-    def _make_rest_call(self, action_result, endpoint, data, params=None, method=requests.post, service_type="services", headers=None):
+    def _make_rest_call(self, action_result, endpoint, data, params=None, method="post", service_type="services", headers=None,
+            call_class=consts.SPLUNK_CALL_CLASS_DEFAULT):
         if params is None:
             params = {}
 
@@ -235,13 +520,13 @@ class SplunkConnector(BaseConnector):
         self.debug_print('Making REST call to {0}'.format(url))
 
         try:
-            response = method(url, data=data, params=params,
+            response = self._send_request(method, url, data=data, params=params,
                     auth=(config.get('username'), config.get('password')), headers=headers,
-                    verify=config['verify_server_cert'])
+                    verify=config['verify_server_cert'], timeout=consts.SPLUNK_REST_TIMEOUTS[call_class])
         except Exception as e:
             return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_CONNECTION_FAILED, e), None
 
-        if method == requests.delete and response.status_code == 200:
+        if method == "delete" and response.status_code == 200:
             return phantom.APP_SUCCESS, response.text
 
         # store the r_text in debug data, it will get dumped in the logs if an error occurs
@@ -278,124 +563,159 @@ class SplunkConnector(BaseConnector):
 
         return phantom.APP_SUCCESS, resp_json
 
-    def _get_server_version(self, action_result):
-
-        endpoint = 'server/info'
-        ret_val, resp_data = self._make_rest_call_retry(action_result, endpoint, {}, method=requests.get)
-
-        if phantom.is_fail(ret_val):
-            return 'FAILURE'
-
-        if consts.SPLUNK_SERVER_VERSION not in resp_data:
-            return 'UNKNOWN'
-
-        begin_version = re.search(consts.SPLUNK_SERVER_VERSION, resp_data).end()
-        end_version = re.search('</s:key>', resp_data[begin_version:]).start()
+    def _get_server_capabilities(self, action_result, refresh=False):
+        """Return what the Splunk server runs: version, product, KV store status and Enterprise Security presence
 
-        return resp_data[begin_version:begin_version + end_version]
+        The capabilities are kept in the state file until their TTL elapses or the asset configuration
+        changes, so that the actions that branch on them do not ask the server every time.
+        """
 
-    def _check_for_es(self, action_result):
+        cached = self._state.get('server_capabilities', {})
+        if (not refresh and cached.get('fingerprint') == self._get_config_fingerprint() and
+                cached.get('expires_at', 0) > time.time()):
+            return RetVal(phantom.APP_SUCCESS, cached['capabilities'])
 
-        endpoint = 'apps/local/SplunkEnterpriseSecuritySuite'
-        ret_val, resp_data = self._make_rest_call_retry(action_result, endpoint, {}, method=requests.get)
-        if phantom.is_fail(ret_val) or not resp_data:
-            return False
-        return True
+        ret_val, resp_data = self._make_rest_call(action_result, 'server/info', {}, params={'output_mode': 'json'}, method="get",
+                call_class=consts.SPLUNK_CALL_CLASS_METADATA)
+        if phantom.is_fail(ret_val):
+            with self._state_lock:
+                self._state.pop('server_capabilities', None)
+            return RetVal(ret_val, None)
 
-    def _resolve_event_id(self, sidandrid, action_result, kwargs_create=dict()):
-        """Query the splunk instance using the SID+RID of the notable to find the notable ID"""
+        try:
+            info = json.loads(resp_data)['entry'][0]['content']
+        except Exception as e:
+            return RetVal(action_result.set_status(phantom.APP_ERROR, "{}. Error: {}".format(consts.SPLUNK_ERR_NOT_JSON, str(e))), None)
+
+        capabilities = {
+            'version': info.get('version', 'UNKNOWN'),
+            'build': info.get('build'),
+            'server_name': info.get('serverName'),
+            'product_type': info.get('product_type'),
+            'kvstore_status': info.get('kvStoreStatus'),
+            'es_installed': False,
+            'es_version': None
+        }
 
-        search_query = r'search [| makeresults | eval myfield = "' + sidandrid + r'" | rex field=myfield "^(?<sid>.*)\+(?<rid>\d*(\.\d+)?)"'
-        search_query += r' | eval search = "( (sid::" . sid . " OR orig_sid::" . sid . ") (rid::" . rid . " OR orig_rid::" . rid . ") )" | table search] `notable` | table event_id'
-        self.send_progress("Running search_query: " + search_query)
+        # The app endpoint answers with a 404 when Enterprise Security is not installed. Any other failure
+        # leaves its presence unknown: it fails the call and nothing is cached, so that the next call checks again
+        config = self.get_config()
+        try:
+            response = self._send_request('get', '{0}services/apps/local/SplunkEnterpriseSecuritySuite'.format(self._base_url),
+                    params={'output_mode': 'json'}, auth=(config.get('username'), config.get('password')),
+                    verify=config['verify_server_cert'], timeout=consts.SPLUNK_REST_TIMEOUTS[consts.SPLUNK_CALL_CLASS_METADATA])
+        except Exception as e:
+            return RetVal(action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_ES_CHECK_FAILED.format(message=e)), None)
 
-        result = self._return_first_row_from_query(search_query, action_result)
+        if response.status_code == 200:
+            capabilities['es_installed'] = True
+            try:
+                capabilities['es_version'] = response.json()['entry'][0]['content'].get('version')
+            except Exception:
+                pass
+        elif response.status_code != 404:
+            message = "status code {}".format(response.status_code)
+            return RetVal(action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_ES_CHECK_FAILED.format(message=message)), None)
+
+        with self._state_lock:
+            self._state['server_capabilities'] = {
+                'capabilities': capabilities,
+                'expires_at': time.time() + consts.SPLUNK_CAPABILITIES_TTL,
+                'fingerprint': self._get_config_fingerprint()
+            }
+
+        return RetVal(phantom.APP_SUCCESS, capabilities)
 
-        if phantom.is_fail(result):
-            return RetVal(action_result.get_status(), None)
+    def _get_server_version(self, action_result):
 
-        if 'event_id' in result:
-            return RetVal(phantom.APP_SUCCESS, result['event_id'])
+        ret_val, capabilities = self._get_server_capabilities(action_result)
+        if phantom.is_fail(ret_val):
+            return 'FAILURE'
 
-        return RetVal(action_result.set_status(phantom.APP_ERROR, "could not find event_id of splunk event"), None)
+        return capabilities['version']
 
-    def _return_first_row_from_query(self, search_query, action_result, kwargs_create=dict()):
-        """Function that executes the query on splunk"""
+    def _check_for_es(self, action_result):
+        """Return whether Enterprise Security is installed, failing when that could not be checked"""
 
-        self.debug_print('Search Query:', search_query)
-        RETRY_LIMIT = int(self.get_config().get('retry_count', 3))
+        ret_val, capabilities = self._get_server_capabilities(action_result)
+        if phantom.is_fail(ret_val):
+            return RetVal(ret_val, None)
 
-        if (phantom.is_fail(self._connect())):
-            return self.get_status()
+        return RetVal(phantom.APP_SUCCESS, capabilities['es_installed'])
 
-        # Validate the search query
-        for attempt_count in range(0, RETRY_LIMIT):
-            try:
-                self._service.parse(search_query, parse_only=True)
-                break
-            except HTTPError as e:
-                return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_INVALID_QUERY, e, query=search_query)
-            except Exception as e:
-                if attempt_count == RETRY_LIMIT - 1:
-                    return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_CONNECTION_FAILED, e)
+    def _resolve_event_ids(self, sidandrids, action_result):
+        """Query the splunk instance using the SID+RID of notables to find their notable IDs, all of them with one search
 
-        self.debug_print(consts.SPLUNK_PROG_CREATED_QUERY.format(query=search_query))
+        Resolved notable IDs are cached in the state file, so that further updates of the same notables
+        do not search again. Returns a dict mapping each SID+RID that was found to its notable ID.
+        """
 
-        # Creating search job
-        self.save_progress(consts.SPLUNK_PROG_CREATING_SEARCH_JOB)
+        now = time.time()
+        cache = self._state.get('event_ids', {})
+        if cache.get('fingerprint') != self._get_config_fingerprint():
+            cache = {}
+        entries = dict((k, v) for k, v in cache.get('entries', {}).items() if v[1] > now)
+
+        resolved = dict((x, entries[x][0]) for x in sidandrids if x in entries)
+        pending = [x for x in sidandrids if x not in resolved]
+
+        # Notables that were just created may not be searchable yet, those are searched again after the pauses of the retry policy
+        pauses = self._retry_policy.delays()
+        while pending:
+            search_query = r'search [| makeresults | eval myfield = split("' + ','.join(pending) + r'", ",") | mvexpand myfield'
+            search_query += r' | rex field=myfield "^(?<sid>.*)\+(?<rid>\d*(\.\d+)?)"'
+            search_query += r' | eval search = "( (sid::" . sid . " OR orig_sid::" . sid . ") (rid::" . rid . " OR orig_rid::" . rid . ") )" | table search]'
+            search_query += r' `notable` | table sid orig_sid rid orig_rid event_id'
+            self.send_progress("Running search_query: " + search_query)
+
+            query_result = ActionResult({})
+            ret_val = self._run_query(search_query, query_result)
+            if phantom.is_fail(ret_val):
+                return RetVal(action_result.set_status(phantom.APP_ERROR, query_result.get_message()), None)
+
+            for sidandrid in list(pending):
+                sid, rid = sidandrid.rsplit('+', 1)
+                for result in query_result.get_data():
+                    if result.get('event_id') and self._matches_sid_rid(result, sid, rid):
+                        resolved[sidandrid] = result['event_id']
+                        entries[sidandrid] = [result['event_id'], now + consts.SPLUNK_EVENT_ID_CACHE_TTL]
+                        pending.remove(sidandrid)
+                        break
 
-        # Set any search creation flags here
-        kwargs_create.update({'exec_mode': 'normal'})
+            if pending:
+                delay = next(pauses, None)
+                if delay is None:
+                    break
+                time.sleep(delay)
 
-        self.debug_print("kwargs_create", kwargs_create)
+        # Only the mappings that expire last are kept
+        if len(entries) > consts.SPLUNK_EVENT_ID_CACHE_SIZE:
+            entries = dict(sorted(entries.items(), key=lambda x: x[1][1])[-consts.SPLUNK_EVENT_ID_CACHE_SIZE:])
+        with self._state_lock:
+            self._state['event_ids'] = {'fingerprint': self._get_config_fingerprint(), 'entries': entries}
 
-        # Create the job
+        return RetVal(phantom.APP_SUCCESS, resolved)
 
-        for search_attempt_count in range(0, RETRY_LIMIT):
-            for attempt_count in range(0, RETRY_LIMIT):
-                try:
-                    job = self._service.jobs.create(search_query, **kwargs_create)
-                    break
-                except Exception as e:
-                    if attempt_count == RETRY_LIMIT - 1:
-                        return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_UNABLE_TO_CREATE_JOB, e)
+    def _matches_sid_rid(self, result, sid, rid):
+        """Whether a notable search result belongs to the given SID and RID"""
 
-            while True:
-                for attempt_count in range(0, RETRY_LIMIT):
-                    try:
-                        while not job.is_ready():
-                            pass
-                        job.refresh()
-                        break
-                    except Exception as e:
-                        if attempt_count == RETRY_LIMIT - 1:
-                            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_CONNECTION_FAILED, e)
-
-                stats = {'is_done': job['isDone'],
-                        'progress': float(job['doneProgress']) * 100,
-                        'scan_count': int(job['scanCount']),
-                        'event_count': int(job['eventCount']),
-                        'result_count': int(job['resultCount'])}
-                status = ("Progress: %(progress)03.1f%%   %(scan_count)d scanned   "
-                        "%(event_count)d matched   %(result_count)d results") % stats
-                self.send_progress(status)
-                if stats['is_done'] == '1':
-                    break
-                time.sleep(2)
+        def values(*fields):
+            found = []
+            for field in fields:
+                value = result.get(field)
+                found.extend(value if isinstance(value, list) else [value])
+            return [x for x in found if x is not None]
 
-            self.send_progress("Parsing results...")
+        if sid not in values('sid', 'orig_sid'):
+            return False
 
+        for value in values('rid', 'orig_rid'):
             try:
-                results = splunk_results.ResultsReader(job.results(count=0))
-            except Exception as e:
-                return action_result.set_status(phantom.APP_ERROR, "Error retrieving results", e)
-
-            for result in results:
-                if isinstance(result, dict):
-                    return result
-            time.sleep(20)
-
-        return action_result.set_status(phantom.APP_ERROR)
+                if value == rid or float(value) == float(rid):
+                    return True
+            except ValueError:
+                continue
+        return False
 
     def _create_kvstore(self, param):
         action_result = self.add_action_result(ActionResult(dict(param)))
@@ -410,7 +730,8 @@ class SplunkConnector(BaseConnector):
 
         endpoint = '{user}/{app}/storage/collections/config'.format(user=user, app=app)
 
-        ret_val, resp_data = self._make_rest_call(action_result, endpoint, data, params={'output_mode': 'json'}, service_type='servicesNS', method=requests.post)
+        ret_val, resp_data = self._make_rest_call(action_result, endpoint, data, params={'output_mode': 'json'}, service_type='servicesNS', method="post",
+                call_class=consts.SPLUNK_CALL_CLASS_KVSTORE)
         if phantom.is_fail(ret_val):
             return action_result.get_status()
 
@@ -432,7 +753,8 @@ class SplunkConnector(BaseConnector):
 
         endpoint = '{user}/{app}/storage/collections/config/{collection_name}'.format(user=user, app=app, collection_name=collection_name)
 
-        ret_val, resp_data = self._make_rest_call(action_result, endpoint, data, params={'output_mode': 'json'}, service_type='servicesNS', method=requests.post)
+        ret_val, resp_data = self._make_rest_call(action_result, endpoint, data, params={'output_mode': 'json'}, service_type='servicesNS', method="post",
+                call_class=consts.SPLUNK_CALL_CLASS_KVSTORE)
         if phantom.is_fail(ret_val):
             return action_result.get_status()
 
@@ -452,13 +774,16 @@ class SplunkConnector(BaseConnector):
         except Exception as err:
             return action_result.set_status(phantom.APP_ERROR, 'Unable to parse data JSON. Details - {}'.format(str(err)))
 
-        batch_save = ''
         if isinstance(data, list):
-            batch_save = '/batch_save'
-        
-        endpoint = '{user}/{app}/storage/collections/data/{collection_name}{batch_save}'.format(user=user, app=app, collection_name=collection_name, batch_save=batch_save)
+            ret_val = self._batch_save_kvstore(action_result, user, app, collection_name, data)
+            self._invalidate_kvstore_snapshot(user, app, collection_name)
+            return ret_val
 
-        ret_val, resp_data = self._make_rest_call(action_result, endpoint, json.dumps(data), params={'output_mode': 'json'}, service_type='servicesNS', method=requests.post, headers={'Content-Type': 'application/json'})
+        endpoint = '{user}/{app}/storage/collections/data/{collection_name}'.format(user=user, app=app, collection_name=collection_name)
+
+        ret_val, resp_data = self._make_rest_call(action_result, endpoint, json.dumps(data), params={'output_mode': 'json'}, service_type='servicesNS', method="post",
+                headers={'Content-Type': 'application/json'}, call_class=consts.SPLUNK_CALL_CLASS_KVSTORE)
+        self._invalidate_kvstore_snapshot(user, app, collection_name)
         
         if phantom.is_fail(ret_val):
             return action_result.get_status()
@@ -467,6 +792,56 @@ class SplunkConnector(BaseConnector):
 
         return action_result.set_status(phantom.APP_SUCCESS, 'KVStore collection successfully updated.')
 
+    def _batch_save_kvstore(self, action_result, user, app, collection_name, records):
+        """Save a list of records to a KV store collection in chunks that are sent concurrently
+
+        Chunks are bounded by record count and size so that Splunk does not reject them, failed
+        chunks are retried on their own and the keys of the saved records are added in input order.
+        """
+
+        endpoint = '{user}/{app}/storage/collections/data/{collection_name}/batch_save'.format(user=user, app=app, collection_name=collection_name)
+
+        serialized = [json.dumps(record) for record in records]
+        chunks = list(iter_batches(serialized, self._kvstore_batch_size, self._kvstore_batch_bytes))
+        concurrency = min(self._kvstore_concurrency, len(chunks)) or 1
+        self.save_progress(consts.SPLUNK_PROG_KVSTORE_CHUNKS, records=len(records), chunks=len(chunks), concurrency=concurrency)
+
+        def save_chunk(chunk):
+            chunk_result = ActionResult({})
+            ret_val, resp_data = self._make_rest_call(chunk_result, endpoint, '[{}]'.format(','.join(chunk)), params={'output_mode': 'json'},
+                    service_type='servicesNS', method="post", headers={'Content-Type': 'application/json'}, call_class=consts.SPLUNK_CALL_CLASS_KVSTORE)
+            return chunk_result if phantom.is_fail(ret_val) else resp_data
+
+        # Each chunk is retried by _make_rest_call, the chunks still failing after that are reported
+        chunk_keys = [None] * len(chunks)
+        pending = []
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for i, response in enumerate(executor.map(save_chunk, chunks)):
+                if isinstance(response, ActionResult):
+                    self.debug_print("Error saving KV store chunk {} of {} records: {}".format(i, len(chunks[i]), response.get_message()))
+                    pending.append(i)
+                    error = response.get_message()
+                else:
+                    chunk_keys[i] = response
+
+        saved_count = 0
+        for keys in chunk_keys:
+            for key in keys or []:
+                action_result.add_data({'_key': key})
+                saved_count += 1
+
+        action_result.update_summary({
+            consts.SPLUNK_JSON_TOTAL_EVENTS: saved_count,
+            'total_chunks': len(chunks),
+            'failed_chunks': len(pending)
+        })
+
+        if pending:
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_KVSTORE_CHUNKS_FAILED.format(failed=len(pending), total=len(chunks),
+                    records=sum(len(chunks[i]) for i in pending), message=error))
+
+        return action_result.set_status(phantom.APP_SUCCESS, 'KVStore collection successfully updated.')
+
     def _delete_record_kvstore(self, param):
         action_result = self.add_action_result(ActionResult(dict(param)))
 
@@ -477,135 +852,506 @@ class SplunkConnector(BaseConnector):
         
         endpoint = '{user}/{app}/storage/collections/data/{collection_name}/{key}'.format(user=user, app=app, collection_name=collection_name, key=key)
 
-        ret_val, resp_data = self._make_rest_call(action_result, endpoint, None, params={'output_mode': 'json'}, service_type='servicesNS', method=requests.delete)
+        ret_val, resp_data = self._make_rest_call(action_result, endpoint, None, params={'output_mode': 'json'}, service_type='servicesNS', method="delete",
+                call_class=consts.SPLUNK_CALL_CLASS_KVSTORE)
+        self._invalidate_kvstore_snapshot(user, app, collection_name)
         
         if phantom.is_fail(ret_val):
             return action_result.get_status()
 
         return action_result.set_status(phantom.APP_SUCCESS, 'KVStore item successfully deleted.')
 
-    def _post_data(self, param):
-
+    def _delete_records_by_query_kvstore(self, param):
         action_result = self.add_action_result(ActionResult(dict(param)))
 
-        host = param.get(consts.SPLUNK_JSON_HOST)
-        index = param.get(consts.SPLUNK_JSON_INDEX)
-        source = param.get(consts.SPLUNK_JSON_SOURCE, consts.SPLUNK_DEFAULT_SOURCE)
-        source_type = param.get(consts.SPLUNK_JSON_SOURCE_TYPE, consts.SPLUNK_DEFAULT_SOURCE_TYPE)
-
-        get_params = {'source': source, 'sourcetype': source_type}
-
-        if host:
-            get_params['host'] = host
-        if index:
-            get_params['index'] = index
-
-        endpoint = 'receivers/simple'
-        ret_val, resp_data = self._make_rest_call_retry(action_result, endpoint, param[consts.SPLUNK_JSON_DATA], params=get_params)
+        user = param.get('user', 'nobody')
+        app = param['app']
+        collection_name = param['collection_name']
 
+        ret_val, query = self._get_kvstore_query(action_result, param.get('query'))
         if phantom.is_fail(ret_val):
-            return ret_val
+            return action_result.get_status()
 
-        return action_result.set_status(phantom.APP_SUCCESS, "Successfully posted the data")
+        # Without a query the whole collection would be emptied
+        if not query or query == '{}':
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_KVSTORE_EMPTY_QUERY)
 
-    def _update_event(self, param):
+        endpoint = '{user}/{app}/storage/collections/data/{collection_name}'.format(user=user, app=app, collection_name=collection_name)
 
-        action_result = self.add_action_result(ActionResult(dict(param)))
+        ret_val, resp_data = self._make_rest_call(action_result, endpoint, None, params={'output_mode': 'json', 'query': query}, service_type='servicesNS',
+                method="delete", call_class=consts.SPLUNK_CALL_CLASS_KVSTORE)
+        self._invalidate_kvstore_snapshot(user, app, collection_name)
 
-        if not self._check_for_es(action_result):
-            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_NOT_ES)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
 
-        owner = param.get(consts.SPLUNK_JSON_OWNER)
-        ids = param.get(consts.SPLUNK_JSON_EVENT_IDS)
-        status = param.get(consts.SPLUNK_JSON_STATUS)
-        integer_status = param.get("integer_status")
-        comment = param.get(consts.SPLUNK_JSON_COMMENT)
-        urgency = param.get(consts.SPLUNK_JSON_URGENCY)
+        return action_result.set_status(phantom.APP_SUCCESS, 'KVStore items matching the query successfully deleted.')
 
-        regexp = re.compile(r"\+\d*(\.\d+)?[\"$]")
-        if regexp.search(json.dumps(ids)):
-            self.send_progress("Interpreting the event ID as an SID + RID combo; querying for the actual event_id...")
-            ret_val, event_id = self._resolve_event_id(ids, action_result, param)
-            if phantom.is_fail(ret_val):
-                return action_result.set_status(phantom.APP_ERROR, "Unable to find underlying event_id from SID + RID combo")
-            ids = event_id
+    def _get_records_kvstore(self, param):
+        action_result = self.add_action_result(ActionResult(dict(param)))
 
-        if not comment and not status and not urgency and not owner and integer_status is None:
-            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_NEED_PARAM)
+        user = param.get('user', 'nobody')
+        app = param['app']
+        collection_name = param['collection_name']
 
-        # 1. Connect and validate whether the given Event IDs are valid or not
-        if (phantom.is_fail(self._connect())):
-            return self.get_status()
+        skip = param.get('skip', 0)
+        ret_val = self._validate_numeric_parameter(skip, allow_zero=True)
+        if phantom.is_fail(ret_val):
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_INVALID_NON_NEGATIVE_PARAM.format(param='skip'))
+        skip = int(skip or 0)
 
-        search_query = '|`incident_review` | search rule_id={0}'.format(ids)
-        ret_val = self._run_query(search_query, action_result)
+        limit = param.get('limit', consts.SPLUNK_DEFAULT_KVSTORE_PAGE_SIZE)
+        ret_val = self._validate_numeric_parameter(limit)
+        if phantom.is_fail(ret_val):
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_INVALID_PARAM.format(param='limit'))
+        limit = int(limit or consts.SPLUNK_DEFAULT_KVSTORE_PAGE_SIZE)
+        if limit > consts.SPLUNK_KVSTORE_MAX_ROWS_PER_QUERY:
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_KVSTORE_LIMIT.format(max=consts.SPLUNK_KVSTORE_MAX_ROWS_PER_QUERY))
 
+        ret_val, query = self._get_kvstore_query(action_result, param.get('query'))
         if phantom.is_fail(ret_val):
-            return action_result.set_status(phantom.APP_ERROR, 'Error occurred while validating the provided event ID. Error: {0}'.format(action_result.get_message()))
+            return action_result.get_status()
 
-        if int(action_result.get_data_size()) <= 0:
-            return action_result.set_status(phantom.APP_ERROR, "Please provide a valid event ID")
+        params = {'output_mode': 'json', 'skip': skip, 'limit': limit}
+        if query:
+            params['query'] = query
+        fields = param.get('fields')
+        if fields:
+            params['fields'] = ','.join(x.strip() for x in fields.split(',') if x.strip())
+        if param.get('sort'):
+            params['sort'] = param['sort']
 
-        # 2. Re-initialize the action_result object for update event
-        self.remove_action_result(action_result)
-        action_result = self.add_action_result(ActionResult(dict(param)))
+        endpoint = '{user}/{app}/storage/collections/data/{collection_name}'.format(user=user, app=app, collection_name=collection_name)
 
-        # 3. Update the provided Events ID
-        request_body = {"ruleUIDs": ids}
+        ret_val, resp_data = self._make_rest_call(action_result, endpoint, None, params=params, service_type='servicesNS', method="get",
+                call_class=consts.SPLUNK_CALL_CLASS_KVSTORE)
 
-        if owner:
-            request_body['newOwner'] = owner
-        if integer_status is not None:
-            if int(integer_status) not in list(consts.SPLUNK_STATUS_DICT.values()):
-                return action_result.set_status(phantom.APP_ERROR, "Please provide a valid value in 'integer_status' action parameter.\
-                    Valid values: {}".format((', '.join(map(str, list(consts.SPLUNK_STATUS_DICT.values())))) ))
-            request_body['status'] = str(integer_status)
-        elif status:
-            if status not in consts.SPLUNK_STATUS_DICT:
-                if not status.isdigit():
-                    return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_BAD_STATUS)
-                request_body['status'] = status
-            else:
-                request_body['status'] = consts.SPLUNK_STATUS_DICT[status]
-        if urgency:
-            request_body['urgency'] = urgency
-        if comment:
-            request_body['comment'] = comment
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
 
-        endpoint = 'notable_update'
-        ret_val, resp_data = self._make_rest_call_retry(action_result, endpoint, request_body)
+        for record in resp_data:
+            action_result.add_data(record)
 
-        if not ret_val:
-            return ret_val
+        # Asking for one record more than the page would not tell a next page apart when the page is
+        # already at the KV store's max_rows_per_query, so a full page is followed by a one record probe
+        more_records = False
+        if resp_data and len(resp_data) >= limit:
+            probe_params = dict(params, skip=skip + len(resp_data), limit=1, fields='_key')
+            ret_val, probe_data = self._make_rest_call(action_result, endpoint, None, params=probe_params, service_type='servicesNS',
+                    method="get", call_class=consts.SPLUNK_CALL_CLASS_KVSTORE)
+            if phantom.is_fail(ret_val):
+                return action_result.get_status()
+            more_records = bool(probe_data)
+
+        action_result.update_summary({
+            'total_records': len(resp_data),
+            'next_skip': skip + len(resp_data) if more_records else None
+        })
 
-        action_result.add_data(resp_data)
-        action_result.update_summary({consts.SPLUNK_JSON_UPDATED_EVENT_ID: ids})
         return action_result.set_status(phantom.APP_SUCCESS)
 
-    def _get_host_events(self, param):
-        """Executes the query to get events pertaining to a host
-            Gets the events for a host for the last 'N' number of days
-        """
+    def _lookup_kvstore(self, param):
+        action_result = self.add_action_result(ActionResult(dict(param)))
 
-        # Connect
-        if (phantom.is_fail(self._connect())):
-            return self.get_status()
+        user = param.get('user', 'nobody')
+        app = param['app']
+        collection_name = param['collection_name']
+        field = param['field']
 
-        action_result = self.add_action_result(ActionResult(dict(param)))
+        values = [x.strip() for x in param['values'].split(',') if x.strip()]
+        if not values:
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_KVSTORE_NO_VALUES)
 
-        ip_hostname = param[phantom.APP_JSON_IP_HOSTNAME]
-        last_n_days = param.get(consts.SPLUNK_JSON_LAST_N_DAYS)
+        endpoint = '{user}/{app}/storage/collections/data/{collection_name}'.format(user=user, app=app, collection_name=collection_name)
 
         try:
-            if int(last_n_days) == 0 or (last_n_days and (not str(last_n_days).isdigit() or int(last_n_days) <= 0)):
-                return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_INVALID_PARAM.format(param="last_n_days"))
+            snapshot = KVStoreSnapshot(self._get_kvstore_snapshot_path(user, app, collection_name),
+                    timeout=consts.SPLUNK_KVSTORE_SNAPSHOT_LOCK_TIMEOUT)
+        except Exception as e:
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_KVSTORE_SNAPSHOT, e)
+
+        try:
+            ret_val, refresh = self._refresh_kvstore_snapshot(action_result, snapshot, endpoint, param.get('modtime_field'),
+                    param.get('force_refresh', False))
+            if phantom.is_fail(ret_val):
+                return action_result.get_status()
 
+            records = snapshot.lookup(field, values)
+            snapshot_count = snapshot.count()
         except Exception as e:
-            return action_result.set_status(phantom.APP_ERROR, "Error parsing last_n_days paramter: {0}".format(e))
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_KVSTORE_SNAPSHOT, e)
+        finally:
+            snapshot.close()
 
-        search_query = 'search host={0}{1}'.format(ip_hostname, ' earliest=-{0}d'.format(last_n_days) if last_n_days else '')
+        for record in records:
+            action_result.add_data(record)
 
-        return self._run_query(search_query, action_result)
+        action_result.update_summary({
+            'total_matches': len(records),
+            'snapshot_records': snapshot_count,
+            'snapshot_refresh': refresh
+        })
+
+        return action_result.set_status(phantom.APP_SUCCESS)
+
+    def _refresh_kvstore_snapshot(self, action_result, snapshot, endpoint, modtime_field, force_refresh):
+        """Bring the local snapshot of a collection up to date, if it is older than the snapshot TTL
+
+        An invalidated snapshot, or one that was last loaded from scratch more than a day ago, is
+        loaded again from scratch. Otherwise records are added and removed by comparing the _key
+        lists, and records whose modtime_field grew since the last refresh are fetched again.
+        Returns how the snapshot was refreshed: none, incremental or full.
+
+        The refresh is made in a single transaction, so that runs refreshing the same snapshot
+        at the same time do not mix their changes, and lookups meanwhile see the previous
+        snapshot. A failed refresh is rolled back.
+        """
+
+        if not force_refresh and self._is_kvstore_snapshot_fresh(snapshot):
+            return RetVal(phantom.APP_SUCCESS, 'none')
+
+        with snapshot.transaction():
+            # Another run may have refreshed the snapshot while this one waited for the lock
+            if not force_refresh and self._is_kvstore_snapshot_fresh(snapshot):
+                return RetVal(phantom.APP_SUCCESS, 'none')
+
+            ret_val, refresh = self._update_kvstore_snapshot(action_result, snapshot, endpoint, modtime_field)
+            if phantom.is_fail(ret_val):
+                snapshot.discard()
+            return RetVal(ret_val, refresh)
+
+    def _is_kvstore_snapshot_fresh(self, snapshot):
+        return snapshot.is_valid() and time.time() - snapshot.get_meta('refreshed_at', 0) < self._kvstore_snapshot_ttl
+
+    def _update_kvstore_snapshot(self, action_result, snapshot, endpoint, modtime_field):
+        now = time.time()
+        modtime = {'max': None}
+
+        def load(records):
+            snapshot.upsert(records)
+            if modtime_field:
+                for record in records:
+                    value = record.get(modtime_field)
+                    try:
+                        if value is not None and (modtime['max'] is None or value > modtime['max']):
+                            modtime['max'] = value
+                    except TypeError:
+                        pass
+
+        if (not snapshot.is_valid() or now - snapshot.get_meta('loaded_at', 0) >= consts.SPLUNK_KVSTORE_SNAPSHOT_MAX_AGE or
+                snapshot.get_meta('modtime_field') != modtime_field):
+            self.save_progress(consts.SPLUNK_PROG_KVSTORE_SNAPSHOT_LOAD)
+            snapshot.clear()
+            ret_val = self._for_each_kvstore_page(action_result, endpoint, {}, load)
+            if phantom.is_fail(ret_val):
+                return RetVal(action_result.get_status(), None)
+            snapshot.set_meta(valid=True, loaded_at=now, refreshed_at=now, modtime_field=modtime_field, max_modtime=modtime['max'])
+            return RetVal(phantom.APP_SUCCESS, 'full')
+
+        remote_keys = set()
+        ret_val = self._for_each_kvstore_page(action_result, endpoint, {'fields': '_key'},
+                lambda records: remote_keys.update(record['_key'] for record in records))
+        if phantom.is_fail(ret_val):
+            return RetVal(action_result.get_status(), None)
+
+        local_keys = snapshot.keys()
+        snapshot.delete(local_keys - remote_keys)
+
+        modtime['max'] = snapshot.get_meta('max_modtime')
+        if modtime_field and modtime['max'] is not None:
+            query = json.dumps({modtime_field: {'$gt': modtime['max']}})
+            ret_val = self._for_each_kvstore_page(action_result, endpoint, {'query': query}, load)
+            if phantom.is_fail(ret_val):
+                return RetVal(action_result.get_status(), None)
+
+        new_keys = sorted(remote_keys - snapshot.keys())
+        for i in range(0, len(new_keys), consts.SPLUNK_KVSTORE_KEYS_PER_QUERY):
+            query = json.dumps({'$or': [{'_key': key} for key in new_keys[i:i + consts.SPLUNK_KVSTORE_KEYS_PER_QUERY]]})
+            ret_val = self._for_each_kvstore_page(action_result, endpoint, {'query': query}, load)
+            if phantom.is_fail(ret_val):
+                return RetVal(action_result.get_status(), None)
+
+        snapshot.set_meta(refreshed_at=now, max_modtime=modtime['max'])
+        return RetVal(phantom.APP_SUCCESS, 'incremental')
+
+    def _for_each_kvstore_page(self, action_result, endpoint, params, callback):
+        """Read all the records of a collection matching params one page at a time, passing each page to callback
+
+        Pages are as large as the KV store returns for one query. Since its max_rows_per_query may be
+        set below the default, a page is only known to be the last one when it holds fewer records
+        than an earlier page, or none at all.
+        """
+
+        skip = 0
+        page_size = 0
+        while True:
+            page_params = dict(params, output_mode='json', sort='_key', skip=skip, limit=consts.SPLUNK_KVSTORE_MAX_ROWS_PER_QUERY)
+            ret_val, records = self._make_rest_call(action_result, endpoint, None, params=page_params, service_type='servicesNS', method="get",
+                    call_class=consts.SPLUNK_CALL_CLASS_KVSTORE)
+            if phantom.is_fail(ret_val):
+                return action_result.get_status()
+
+            if records:
+                callback(records)
+
+            if not records or len(records) < page_size:
+                return phantom.APP_SUCCESS
+            page_size = max(page_size, len(records))
+            skip += len(records)
+
+    def _get_kvstore_snapshot_path(self, user, app, collection_name):
+        collection = hashlib.sha256('{}/{}/{}'.format(user, app, collection_name).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.get_state_dir(), '{}_kvstore_{}.db'.format(self.get_asset_id(), collection))
+
+    def _invalidate_kvstore_snapshot(self, user, app, collection_name):
+        """Make the next lookup load the local snapshot of a collection this app wrote to from scratch"""
+
+        path = self._get_kvstore_snapshot_path(user, app, collection_name)
+        if not os.path.exists(path):
+            return
+
+        try:
+            snapshot = KVStoreSnapshot(path, timeout=consts.SPLUNK_KVSTORE_SNAPSHOT_LOCK_TIMEOUT)
+            snapshot.invalidate()
+            snapshot.close()
+        except Exception as e:
+            self.debug_print("Unable to invalidate the KV store snapshot {}: {}".format(path, e))
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _get_kvstore_query(self, action_result, query):
+        """Validate a KV store query given as a JSON object and return it serialized"""
+
+        if not query:
+            return RetVal(phantom.APP_SUCCESS, None)
+
+        try:
+            query = json.loads(query)
+        except Exception as err:
+            return RetVal(action_result.set_status(phantom.APP_ERROR, 'Unable to parse query JSON. Details - {}'.format(str(err))), None)
+
+        if not isinstance(query, dict):
+            return RetVal(action_result.set_status(phantom.APP_ERROR, 'Unable to parse query JSON. Details - the query must be a JSON object'), None)
+
+        return RetVal(phantom.APP_SUCCESS, json.dumps(query))
+
+    def _post_data(self, param):
+
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        host = param.get(consts.SPLUNK_JSON_HOST)
+        index = param.get(consts.SPLUNK_JSON_INDEX)
+        source = param.get(consts.SPLUNK_JSON_SOURCE, consts.SPLUNK_DEFAULT_SOURCE)
+        source_type = param.get(consts.SPLUNK_JSON_SOURCE_TYPE, consts.SPLUNK_DEFAULT_SOURCE_TYPE)
+
+        get_params = {'source': source, 'sourcetype': source_type}
+
+        if host:
+            get_params['host'] = host
+        if index:
+            get_params['index'] = index
+
+        data = param[consts.SPLUNK_JSON_DATA]
+        if param.get(consts.SPLUNK_JSON_MULTIPLE_EVENTS, False):
+            try:
+                events = json.loads(data)
+            except Exception as e:
+                return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_INVALID_EVENTS, e)
+            if not isinstance(events, list) or not events:
+                return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_INVALID_EVENTS)
+        else:
+            events = [data]
+
+        if self.get_config().get('hec_token'):
+            return self._post_data_hec(action_result, events, get_params)
+
+        endpoint = 'receivers/simple'
+        for event in events:
+            if isinstance(event, (dict, list)):
+                event = json.dumps(event)
+            ret_val, resp_data = self._make_rest_call(action_result, endpoint, event, params=get_params,
+                    call_class=consts.SPLUNK_CALL_CLASS_INGEST)
+
+            if phantom.is_fail(ret_val):
+                return ret_val
+
+        action_result.update_summary({consts.SPLUNK_JSON_TOTAL_EVENTS: len(events)})
+
+        return action_result.set_status(phantom.APP_SUCCESS, "Successfully posted the data")
+
+    def _post_data_hec(self, action_result, events, metadata):
+        """Send events to the HTTP Event Collector in gzip compressed batches bounded by count and size"""
+
+        config = self.get_config()
+        url = 'https://{0}:{1}/services/collector/event'.format(config['device'], self._hec_port)
+        headers = {
+            'Authorization': 'Splunk {}'.format(config['hec_token']),
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip'
+        }
+
+        payloads = [json.dumps(dict(metadata, event=event)).encode('utf-8') for event in events]
+
+        posted_count = 0
+        batch_count = 0
+        for batch in iter_batches(payloads, self._hec_batch_size, self._hec_batch_bytes):
+            ret_val = self._send_hec_batch(action_result, url, headers, gzip_compress(b'\n'.join(batch)))
+            if phantom.is_fail(ret_val):
+                action_result.update_summary({consts.SPLUNK_JSON_TOTAL_EVENTS: posted_count, 'total_batches': batch_count})
+                return action_result.get_status()
+            posted_count += len(batch)
+            batch_count += 1
+
+        action_result.update_summary({consts.SPLUNK_JSON_TOTAL_EVENTS: posted_count, 'total_batches': batch_count})
+
+        return action_result.set_status(phantom.APP_SUCCESS, consts.SPLUNK_SUCC_HEC_POSTED.format(events=posted_count, batches=batch_count))
+
+    def _send_hec_batch(self, action_result, url, headers, body):
+
+        try:
+            response = self._send_request('post', url, data=body, headers=headers, verify=self.get_config()['verify_server_cert'],
+                    timeout=consts.SPLUNK_REST_TIMEOUTS[consts.SPLUNK_CALL_CLASS_INGEST])
+        except Exception as e:
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_CONNECTION_FAILED, e)
+
+        if 200 <= response.status_code <= 399:
+            return phantom.APP_SUCCESS
+
+        try:
+            message = response.json().get('text', response.text)
+        except Exception:
+            message = response.text
+        return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_HEC_FAILED.format(status=response.status_code, message=message))
+
+    def _update_event(self, param):
+
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        ret_val, es_installed = self._check_for_es(action_result)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        if not es_installed:
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_NOT_ES)
+
+        owner = param.get(consts.SPLUNK_JSON_OWNER)
+        ids = param.get(consts.SPLUNK_JSON_EVENT_IDS)
+        status = param.get(consts.SPLUNK_JSON_STATUS)
+        integer_status = param.get("integer_status")
+        comment = param.get(consts.SPLUNK_JSON_COMMENT)
+        urgency = param.get(consts.SPLUNK_JSON_URGENCY)
+
+        if not comment and not status and not urgency and not owner and integer_status is None:
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_NEED_PARAM)
+
+        event_ids = [x.strip() for x in ids.split(',') if x.strip()]
+        if not event_ids:
+            return action_result.set_status(phantom.APP_ERROR, "Please provide a valid event ID")
+
+        request_body = {}
+
+        if owner:
+            request_body['newOwner'] = owner
+        if integer_status is not None:
+            if int(integer_status) not in list(consts.SPLUNK_STATUS_DICT.values()):
+                return action_result.set_status(phantom.APP_ERROR, "Please provide a valid value in 'integer_status' action parameter.\
+                    Valid values: {}".format((', '.join(map(str, list(consts.SPLUNK_STATUS_DICT.values())))) ))
+            request_body['status'] = str(integer_status)
+        elif status:
+            if status not in consts.SPLUNK_STATUS_DICT:
+                if not status.isdigit():
+                    return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_BAD_STATUS)
+                request_body['status'] = status
+            else:
+                request_body['status'] = consts.SPLUNK_STATUS_DICT[status]
+        if urgency:
+            request_body['urgency'] = urgency
+        if comment:
+            request_body['comment'] = comment
+
+        if (phantom.is_fail(self._connect())):
+            return self.get_status()
+
+        regexp = re.compile(r"\+\d*(\.\d+)?$")
+        sidandrids = [x for x in event_ids if regexp.search(x)]
+        if sidandrids:
+            self.send_progress("Interpreting the event IDs ending with +RID as SID + RID combos; querying for the actual event_ids...")
+            ret_val, resolved = self._resolve_event_ids(sidandrids, action_result)
+            if phantom.is_fail(ret_val):
+                return action_result.set_status(phantom.APP_ERROR, "Unable to find underlying event_id from SID + RID combo. {0}".format(action_result.get_message()))
+            unresolved = [x for x in sidandrids if x not in resolved]
+            if unresolved:
+                return action_result.set_status(phantom.APP_ERROR, "Unable to find underlying event_id from SID + RID combo: {0}".format(', '.join(unresolved)))
+            event_ids = [resolved.get(x, x) for x in event_ids]
+            ids = ','.join(event_ids)
+
+        # 1. Validate whether the given Event IDs are valid or not, all of them with one search
+        rule_ids = ' OR '.join('rule_id="{0}"'.format(x.replace('"', '\\"')) for x in event_ids)
+        search_query = '|`incident_review` | search {0} | dedup rule_id | table rule_id'.format(rule_ids)
+        ret_val = self._run_query(search_query, action_result)
+
+        if phantom.is_fail(ret_val):
+            return action_result.set_status(phantom.APP_ERROR, 'Error occurred while validating the provided event ID. Error: {0}'.format(action_result.get_message()))
+
+        found_ids = set(x.get('rule_id') for x in action_result.get_data())
+        invalid_ids = [x for x in event_ids if x not in found_ids]
+        if invalid_ids:
+            return action_result.set_status(phantom.APP_ERROR, "Please provide a valid event ID. Invalid event IDs: {0}".format(', '.join(invalid_ids)))
+
+        # 2. Re-initialize the action_result object for update event
+        self.remove_action_result(action_result)
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        # 3. Update the provided Events ID, as few notable_update calls as possible
+        endpoint = 'notable_update'
+        for i in range(0, len(event_ids), consts.SPLUNK_NOTABLE_UPDATE_BATCH_SIZE):
+            request_body['ruleUIDs'] = event_ids[i:i + consts.SPLUNK_NOTABLE_UPDATE_BATCH_SIZE]
+            ret_val, resp_data = self._make_rest_call(action_result, endpoint, request_body, call_class=consts.SPLUNK_CALL_CLASS_NOTABLE)
+
+            if not ret_val:
+                return ret_val
+
+            action_result.add_data(resp_data)
+
+        action_result.update_summary({consts.SPLUNK_JSON_UPDATED_EVENT_ID: ids, 'total_event_ids': len(event_ids)})
+        return action_result.set_status(phantom.APP_SUCCESS)
+
+    def _get_host_events(self, param):
+        """Executes the query to get events pertaining to a host
+            Gets the events for a host for the last 'N' number of days
+        """
+
+        # Connect
+        if (phantom.is_fail(self._connect())):
+            return self.get_status()
+
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        ip_hostname = param[phantom.APP_JSON_IP_HOSTNAME]
+        last_n_days = param.get(consts.SPLUNK_JSON_LAST_N_DAYS)
+
+        try:
+            if int(last_n_days) == 0 or (last_n_days and (not str(last_n_days).isdigit() or int(last_n_days) <= 0)):
+                return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_INVALID_PARAM.format(param="last_n_days"))
+
+        except Exception as e:
+            return action_result.set_status(phantom.APP_ERROR, "Error parsing last_n_days paramter: {0}".format(e))
+
+        execution_mode = param.get(consts.SPLUNK_JSON_EXECUTION_MODE, consts.SPLUNK_EXEC_MODE_NORMAL)
+        if execution_mode not in consts.SPLUNK_EXEC_MODES:
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_INVALID_EXEC_MODE.format(modes=', '.join(consts.SPLUNK_EXEC_MODES)))
+
+        ret_val, max_runtime = self._get_max_runtime(param, action_result)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        search_query = 'search host={0}{1}'.format(ip_hostname, ' earliest=-{0}d'.format(last_n_days) if last_n_days else '')
+
+        return self._run_query(search_query, action_result, max_rows=self._max_result_rows, max_bytes=self._max_result_bytes,
+                execution_mode=execution_mode, reuse_job=True, max_runtime=max_runtime, allow_partial=self._finalize_on_timeout,
+                vault_rows=self._vault_result_rows)
 
     def _on_poll(self, param):
         if (phantom.is_fail(self._connect())):
@@ -646,95 +1392,380 @@ class SplunkConnector(BaseConnector):
             Therefore, 'container_count' parameter will be ignored".format(int(search_params['max_count'])))
             search_params.pop('max_count')
 
-        ret_val = self._run_query(search_query, action_result, search_params, parse_only=po)
+        backfill_slices = self._get_backfill_slices(start_time)
+
+        if self._on_poll_pipeline and not backfill_slices:
+            return self._on_poll_pipelined(search_query, search_params, po, action_result)
+
+        if backfill_slices:
+            ret_val, data, watermark = self._run_backfill_queries(search_query, search_params, backfill_slices, po, action_result)
+        else:
+            ret_val = self._run_query(search_query, action_result, search_params, parse_only=po)
 
         if phantom.is_fail(ret_val):
-        
             self.save_progress(action_result.get_message())
             return self.set_status(phantom.APP_ERROR)
 
-        display = config.get('on_poll_display')
-        
-        header_set = None
-        if display:
-            header_set = {x.strip().lower() for x in display.split(',')}
-        
-        # Set the most recent event to data[0]
-        data = list(reversed(action_result.get_data()))
+        if not backfill_slices:
+            # Set the most recent event to data[0]
+            data = list(reversed(action_result.get_data()))
+            watermark = data[-1].get('_indextime') if data else None
         self.save_progress("Finished search")
 
-        if data and not self.is_poll_now():
-            self._state['start_time'] = data[-1].get('_indextime')
-        
+        if watermark and not self.is_poll_now():
+            self._state['start_time'] = watermark
+
+        # Compile the CEF mapping and the container naming once for all the results
+        fields = set()
         for item in data:
-            container = {}
-            cef = {}
-            if header_set:
-                name_mappings = {}
-                for k, v in list(item.items()):
-                    if k.lower() in header_set:
-                        # Use this to keep the orignal capitalization from splunk
-                        name_mappings[k.lower()] = k
-                for h in header_set:
-                    cef[name_mappings.get(consts.CIM_CEF_MAP.get(h, h), h)] = item.get(name_mappings.get(h, h))
-            else:
-                for k, v in list(item.items()):
-                    cef[consts.CIM_CEF_MAP.get(k, k)] = v
-            md5 = hashlib.md5()
-            if '_raw' in item:
+            fields.update(item)
+        mapping_plan = self._get_cef_mapping_plan(fields)
+
+        # Source data identifiers of the events ingested by the previous polls
+        seen = BoundedSeenSet(self._dedupe_index_size, self._state.get('ingested_sdis'))
+        queued = set()
+
+        containers = []
+        saved_count = 0
+        duplicate_count = 0
+        ingest_start_time = time.time()
+
+        for item in data:
+            sdi = self._get_source_data_identifier(item)
+            if sdi in seen or sdi in queued:
+                duplicate_count += 1
+                continue
+            queued.add(sdi)
+
+            containers.append(self._create_container(item, sdi, mapping_plan))
+            if len(containers) >= self._ingest_batch_size:
+                saved_count += self._save_container_batch(containers, seen)
+                containers = []
+
+        if containers:
+            saved_count += self._save_container_batch(containers, seen)
+
+        self._finish_ingestion(action_result, seen, len(queued), saved_count, duplicate_count, time.time() - ingest_start_time)
+
+        return self.set_status(phantom.APP_SUCCESS)
+
+    def _on_poll_pipelined(self, search_query, search_params, parse_only, action_result):
+        """Ingest the results of the poll query while they are being downloaded
+
+        A reader thread downloads the results in chunks, a mapper thread turns them into containers
+        and this thread saves them. The stages are connected by bounded queues, so only a few chunks
+        are held in memory however many results the poll returns. Results are ingested in the order
+        Splunk returns them, newest first, and the watermark only moves once all of them are read.
+        """
+
+        ret_val, query = self._start_query(search_query, action_result, search_params, parse_only=parse_only)
+        if phantom.is_fail(ret_val):
+            self.save_progress(action_result.get_message())
+            return self.set_status(phantom.APP_ERROR)
+        results, _ = query
+
+        self.save_progress(consts.SPLUNK_PROG_PIPELINE, chunk_size=consts.SPLUNK_PIPELINE_CHUNK_SIZE,
+                queue_size=consts.SPLUNK_PIPELINE_QUEUE_SIZE)
+
+        result_chunks = queue.Queue(maxsize=consts.SPLUNK_PIPELINE_QUEUE_SIZE)
+        container_chunks = queue.Queue(maxsize=consts.SPLUNK_PIPELINE_QUEUE_SIZE)
+        # Set once the saving stage stops, so that the other stages do not block on a full or empty queue
+        stopped = threading.Event()
+        errors = []
+
+        seen = BoundedSeenSet(self._dedupe_index_size, self._state.get('ingested_sdis'))
+        stats = {'results': 0, 'queued': 0, 'duplicates': 0, 'watermark': None}
+
+        def put(chunks, chunk):
+            while not stopped.is_set():
                 try:
-                    md5.update(item.get('_raw').encode('UTF-8'))
-                except TypeError:
-                    md5.update(str(item).encode('UTF-8'))
-            else:
-                md5.update(str(item).encode('UTF-8'))
+                    chunks.put(chunk, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
 
-            sdi = md5.hexdigest()
-            severity = self._get_splunk_severity(item)
-            container['artifacts'] = [
-                {
-                    'cef': cef,
-                    'name': 'Field Values',
-                    'source_data_identifier': sdi,
-                    'severity': severity
-                }
-            ]
-            container['name'] = self._get_splunk_title(item)
-            container['severity'] = severity
-            container['source_data_identifier'] = sdi
-            
-            ret_val, msg, cid = self.save_container(container)
-            if phantom.is_fail(ret_val):
-                self.save_progress("Error saving container: {}".format(msg))
-                self.debug_print("Error saving container: {} -- CID: {}".format(msg, cid))
+        def get(chunks):
+            # None, like the end of the chunks, once the saving stage stopped and nothing more is coming
+            while not stopped.is_set():
+                try:
+                    return chunks.get(timeout=1)
+                except queue.Empty:
+                    continue
+            return None
+
+        def read_results():
+            chunk = []
+            try:
+                for result in results:
+                    chunk.append(result)
+                    if len(chunk) >= consts.SPLUNK_PIPELINE_CHUNK_SIZE:
+                        if not put(result_chunks, chunk):
+                            return
+                        chunk = []
+            except Exception as e:
+                errors.append("Error retrieving results: {}".format(e))
+            finally:
+                results.close()
+                if chunk:
+                    put(result_chunks, chunk)
+                put(result_chunks, None)
+
+        def map_results():
+            fields = set()
+            mapping_plan = None
+            queued = set()
+            try:
+                while True:
+                    chunk = get(result_chunks)
+                    if chunk is None:
+                        break
+
+                    # The mapping is only compiled again when a chunk brings in new fields
+                    chunk_fields = set()
+                    for item in chunk:
+                        chunk_fields.update(item)
+                    if mapping_plan is None or not chunk_fields.issubset(fields):
+                        fields.update(chunk_fields)
+                        mapping_plan = self._get_cef_mapping_plan(fields)
+
+                    containers = []
+                    for item in chunk:
+                        stats['results'] += 1
+                        try:
+                            indextime = float(item.get('_indextime'))
+                            if stats['watermark'] is None or indextime > float(stats['watermark']):
+                                stats['watermark'] = item['_indextime']
+                        except (TypeError, ValueError):
+                            pass
+
+                        sdi = self._get_source_data_identifier(item)
+                        if sdi in seen or sdi in queued:
+                            stats['duplicates'] += 1
+                            continue
+                        queued.add(sdi)
+                        containers.append(self._create_container(item, sdi, mapping_plan))
+
+                    stats['queued'] = len(queued)
+                    if containers and not put(container_chunks, containers):
+                        return
+            except Exception as e:
+                errors.append("Error creating containers: {}".format(e))
+            finally:
+                put(container_chunks, None)
+
+        stages = [threading.Thread(target=read_results), threading.Thread(target=map_results)]
+        for stage in stages:
+            stage.daemon = True
+            stage.start()
+
+        containers = []
+        saved_count = 0
+        ingest_start_time = time.time()
+
+        try:
+            while True:
+                chunk = container_chunks.get()
+                if chunk is None:
+                    break
+                containers.extend(chunk)
+                while len(containers) >= self._ingest_batch_size:
+                    saved_count += self._save_container_batch(containers[:self._ingest_batch_size], seen)
+                    containers = containers[self._ingest_batch_size:]
+
+            if containers:
+                saved_count += self._save_container_batch(containers, seen)
+        finally:
+            stopped.set()
+            for stage in stages:
+                stage.join()
+
+        self._finish_ingestion(action_result, seen, stats['queued'], saved_count, stats['duplicates'], time.time() - ingest_start_time)
+        action_result.update_summary({consts.SPLUNK_JSON_TOTAL_EVENTS: stats['results']})
+
+        if errors:
+            # The results that could not be read are searched again by the next poll
+            self.save_progress(errors[0])
+            return self.set_status(phantom.APP_ERROR)
+
+        self.save_progress("Finished search")
+
+        if stats['watermark'] and not self.is_poll_now():
+            self._state['start_time'] = stats['watermark']
 
         return self.set_status(phantom.APP_SUCCESS)
 
-    def _get_splunk_title(self, item):
-        title = self._container_name_prefix
-        if not title and not self._container_name_values:
-            self._container_name_values.append('source')
+    def _get_cef_mapping_plan(self, fields):
+        display = self.get_config().get('on_poll_display')
+        return CEFMappingPlan(consts.CIM_CEF_MAP, fields, display.split(',') if display else None,
+                self._container_name_prefix, self._container_name_values)
+
+    def _create_container(self, item, sdi, mapping_plan):
+        container = {}
+        severity = self._get_splunk_severity(item)
+        container['artifacts'] = [
+            {
+                'cef': mapping_plan.cef(item),
+                'name': 'Field Values',
+                'source_data_identifier': sdi,
+                'severity': severity
+            }
+        ]
+        container['name'] = mapping_plan.name(item)
+        container['severity'] = severity
+        container['source_data_identifier'] = sdi
+
+        return container
+
+    def _finish_ingestion(self, action_result, seen, queued_count, saved_count, duplicate_count, ingest_duration):
+        """Persist the identifiers of the ingested events and summarize the ingestion"""
+
+        if self._dedupe_index_size:
+            self._state['ingested_sdis'] = seen.keys()
+        else:
+            self._state.pop('ingested_sdis', None)
 
-        values = ''
-        for i in range(len(self._container_name_values)):
-            value = item.get(consts.CIM_CEF_MAP.get(self._container_name_values[i],
-                self._container_name_values[i]))
-            if value:
-                values += "{}{}".format(value, '' if i == len(self._container_name_values) - 1 else ', ')
+        action_result.update_summary({
+            'containers_saved': saved_count,
+            'containers_failed': queued_count - saved_count,
+            'duplicates_skipped': duplicate_count,
+            'containers_per_second': round(queued_count / ingest_duration, 1) if ingest_duration > 0 else 0
+        })
 
-        if values.strip() == '' and len(self._container_name_values) > 0:
-            values = ', '.join([item[value.strip()] for value in self._container_name_values.split(',') if value])
+    def _get_backfill_slices(self, start_time):
+        """Split the index time range of a poll that is lagging behind into (earliest, latest) slices
 
-        if not title:
-            time = item.get('_time')
-            if time:
-                title = "Splunk Log Entry on {}".format(time)
-            else:
-                title = "Splunk Log Entry"
+        Returns an empty list if the poll is not lagging behind by more than one slice
+        """
+
+        if not start_time or not self._backfill_slice_seconds or self.is_poll_now():
+            return []
+
+        try:
+            earliest = int(float(start_time))
+        except ValueError:
+            return []
+
+        now = int(time.time())
+        if now - earliest <= self._backfill_slice_seconds:
+            return []
+
+        slices = []
+        while earliest < now and len(slices) < consts.SPLUNK_MAX_BACKFILL_SLICES:
+            latest = min(earliest + self._backfill_slice_seconds, now)
+            slices.append((earliest, latest))
+            earliest = latest
+
+        return slices
+
+    def _run_backfill_queries(self, search_query, search_params, slices, parse_only, action_result):
+        """Run the poll query over consecutive index time slices, a few of them concurrently
+
+        Slices are searched with the max_count of the poll and taken in order, until one fails or
+        the results would exceed max_count, so that the watermark never moves past events that were
+        not returned. A slice returning max_count results may have been cut short: it is left to the
+        next poll, unless it comes first, in which case it is split in two and searched again. Returns
+        the results of the slices taken in _indextime order along with the end of the last of them as
+        the new watermark.
+        """
+
+        max_count = int(search_params.get('max_count') or 0)
+        concurrency = min(self._backfill_concurrency, len(slices))
+        self.save_progress(consts.SPLUNK_PROG_BACKFILL, slices=len(slices), seconds=self._backfill_slice_seconds, concurrency=concurrency)
+
+        def run_slice(time_slice):
+            slice_params = dict(search_params, index_earliest=time_slice[0], index_latest=time_slice[1])
+            slice_result = ActionResult(slice_params)
+            self._run_query(search_query, slice_result, slice_params, parse_only=parse_only)
+            return slice_result
+
+        data = []
+        watermark = None
+        message = None
+        completed = 0
+        pending = deque(slices)
+        running = deque()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while pending or running:
+                # Only a few slices are searched ahead of the one being taken, to hold at most a few capped slices in memory
+                while pending and len(running) < concurrency:
+                    time_slice = pending.popleft()
+                    running.append((time_slice, executor.submit(run_slice, time_slice)))
+
+                (earliest, latest), future = running.popleft()
+                slice_result = future.result()
+                if phantom.is_fail(slice_result.get_status()):
+                    self.save_progress(consts.SPLUNK_PROG_BACKFILL_SLICE_FAILED, earliest=earliest, latest=latest, message=slice_result.get_message())
+                    message = slice_result.get_message()
+                    break
+
+                slice_data = slice_result.get_data()
+                capped = max_count and len(slice_data) >= max_count
+                if capped and not data and latest - earliest > 1:
+                    middle = (earliest + latest) // 2
+                    running.appendleft(((middle, latest), executor.submit(run_slice, (middle, latest))))
+                    running.appendleft(((earliest, middle), executor.submit(run_slice, (earliest, middle))))
+                    continue
+
+                if data and max_count and len(data) + len(slice_data) > max_count:
+                    break
+
+                if capped:
+                    self.save_progress(consts.SPLUNK_PROG_BACKFILL_SLICE_CAPPED, earliest=earliest, latest=latest, max_count=max_count)
+                data.extend(slice_data)
+                watermark = str(latest)
+                completed += 1
+
+            for _, future in running:
+                future.cancel()
+
+        action_result.update_summary({'backfill_slices': len(slices), 'backfill_slices_completed': completed})
+
+        if watermark is None:
+            return action_result.set_status(phantom.APP_ERROR, message), None, None
+
+        data.sort(key=lambda item: float(item.get('_indextime', 0)))
+        action_result.update_summary({consts.SPLUNK_JSON_TOTAL_EVENTS: len(data)})
+
+        return action_result.set_status(phantom.APP_SUCCESS), data, watermark
+
+    def _get_source_data_identifier(self, item):
+        """MD5 of the raw event, or of the whole result if it has no raw event"""
+
+        md5 = hashlib.md5()
+        if '_raw' in item:
+            try:
+                md5.update(item.get('_raw').encode('UTF-8'))
+            except (TypeError, AttributeError):
+                md5.update(str(item).encode('UTF-8'))
         else:
-            title = item.get(title, title)
+            md5.update(str(item).encode('UTF-8'))
+
+        return md5.hexdigest()
+
+    def _save_container_batch(self, containers, seen):
+        """Save a batch of containers with a single platform call and return how many were saved
+
+        The source data identifiers of the saved containers are added to seen
+        """
+
+        ret_val, msg, responses = self.save_containers(containers)
+        if phantom.is_fail(ret_val):
+            self.save_progress("Error saving containers: {}".format(msg))
+            self.debug_print("Error saving a batch of {} containers: {}".format(len(containers), msg))
+            return 0
+
+        saved_count = 0
+        for container, response in zip(containers, responses):
+            if response.get('success', not response.get('failed')):
+                saved_count += 1
+                seen.add(container['source_data_identifier'])
+                continue
+            self.save_progress("Error saving container: {}".format(response.get('message')))
+            self.debug_print("Error saving container: {} -- SDI: {}".format(response.get('message'), container['source_data_identifier']))
 
-        return "{}: {}".format(title, values)
+        return saved_count
 
     def _get_splunk_severity(self, item):
         severity = item.get('severity')
@@ -756,18 +1787,156 @@ class SplunkConnector(BaseConnector):
         search_command = param.get(consts.SPLUNK_JSON_COMMAND)
         search_string = param.get(consts.SPLUNK_JSON_QUERY)
         po = param.get(consts.SPLUNK_JSON_PARSE_ONLY, False)
+        execution_mode = param.get(consts.SPLUNK_JSON_EXECUTION_MODE, consts.SPLUNK_EXEC_MODE_NORMAL)
+
+        if execution_mode not in consts.SPLUNK_EXEC_MODES:
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_INVALID_EXEC_MODE.format(modes=', '.join(consts.SPLUNK_EXEC_MODES)))
+
+        ret_val, max_runtime = self._get_max_runtime(param, action_result)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
 
         try:
-            if not search_command:
-                if (search_string[0] != '|') and (search_string.find('search', 0) != 0):
-                    search_string = 'search {}'.format(search_string.strip())
-                search_query = search_string
-            else:
-                search_query = '{0} {1}'.format(search_command.strip(), search_string.strip())
+            search_query = self._get_search_query(search_command, search_string)
         except:
             return action_result.set_status(phantom.APP_ERROR, "Error occurred while parsing the search query")
 
-        return self._run_query(search_query, action_result, parse_only=po)
+        return self._run_query(search_query, action_result, parse_only=po, max_rows=self._max_result_rows, max_bytes=self._max_result_bytes,
+                execution_mode=execution_mode, reuse_job=True, max_runtime=max_runtime, allow_partial=self._finalize_on_timeout,
+                vault_rows=self._vault_result_rows)
+
+    def _get_max_runtime(self, param, action_result):
+        """Return the max_runtime parameter of an action, None when it is not given so that job_max_wait applies"""
+
+        max_runtime = param.get(consts.SPLUNK_JSON_MAX_RUNTIME)
+        if max_runtime is None or max_runtime == '':
+            return RetVal(phantom.APP_SUCCESS, None)
+
+        ret_val = self._validate_numeric_parameter(max_runtime, allow_zero=True)
+        if phantom.is_fail(ret_val):
+            return RetVal(action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_INVALID_NON_NEGATIVE_PARAM.format(param=consts.SPLUNK_JSON_MAX_RUNTIME)), None)
+
+        return RetVal(phantom.APP_SUCCESS, int(max_runtime))
+
+    def _get_search_query(self, search_command, search_string):
+        """Build the query to run from the command and the query string given by the user"""
+
+        if not search_command:
+            if (search_string[0] != '|') and (search_string.find('search', 0) != 0):
+                search_string = 'search {}'.format(search_string.strip())
+            return search_string
+
+        return '{0} {1}'.format(search_command.strip(), search_string.strip())
+
+    def _get_search_concurrency_quota(self):
+        """Return how many searches the configured user may run at the same time, None if unknown"""
+
+        username = self.get_config().get('username')
+        if not username:
+            return None
+
+        try:
+            # A user gets the highest quota of its roles, 0 means that the role sets no limit
+            quotas = [int(self._service.roles[role]['srchJobsQuota']) for role in self._service.users[username]['roles']]
+        except Exception as e:
+            self.debug_print("Unable to read the concurrent search quota of the user: {}".format(e))
+            return None
+
+        quotas = [quota for quota in quotas if quota > 0]
+        return max(quotas) if quotas else None
+
+    def _run_batch_query_item(self, search_query, parse_only, max_runtime=None):
+        """Run one query of a batch and return its results along with its status and timing"""
+
+        item_result = ActionResult({consts.SPLUNK_JSON_QUERY: search_query})
+
+        start_time = time.time()
+        self._run_query(search_query, item_result, parse_only=parse_only, max_rows=self._max_result_rows, max_bytes=self._max_result_bytes,
+                reuse_job=True, max_runtime=max_runtime, allow_partial=self._finalize_on_timeout)
+        duration = time.time() - start_time
+
+        summary = item_result.get_summary()
+
+        return {
+            'query': search_query,
+            'status': 'success' if phantom.is_success(item_result.get_status()) else 'failed',
+            'message': item_result.get_message(),
+            'total_events': summary.get(consts.SPLUNK_JSON_TOTAL_EVENTS, 0),
+            'truncated': summary.get(consts.SPLUNK_JSON_TRUNCATED, False),
+            'finalized': summary.get(consts.SPLUNK_JSON_FINALIZED, False),
+            'duration': round(duration, 3),
+            'results': item_result.get_data()
+        }
+
+    def _handle_run_batch_query(self, param):
+
+        # Connect
+        if (phantom.is_fail(self._connect())):
+            return self.get_status()
+
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        search_command = param.get(consts.SPLUNK_JSON_COMMAND)
+        queries = param[consts.SPLUNK_JSON_QUERIES]
+        po = param.get(consts.SPLUNK_JSON_PARSE_ONLY, False)
+
+        max_concurrency = param.get(consts.SPLUNK_JSON_MAX_CONCURRENCY, consts.SPLUNK_DEFAULT_BATCH_CONCURRENCY)
+        ret_val = self._validate_numeric_parameter(max_concurrency)
+        if phantom.is_fail(ret_val):
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_INVALID_PARAM.format(param=consts.SPLUNK_JSON_MAX_CONCURRENCY))
+
+        ret_val, max_runtime = self._get_max_runtime(param, action_result)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        try:
+            queries = json.loads(queries)
+        except ValueError:
+            pass
+
+        if not isinstance(queries, list):
+            queries = param[consts.SPLUNK_JSON_QUERIES].splitlines()
+
+        try:
+            search_queries = [self._get_search_query(search_command, query) for query in queries if query.strip()]
+        except:
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_INVALID_QUERIES)
+
+        if not search_queries:
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_INVALID_QUERIES)
+
+        # Stay within the concurrent search quota of the user, extra searches would only be queued by Splunk
+        concurrency = min(int(max_concurrency), len(search_queries))
+        quota = self._get_search_concurrency_quota()
+        if quota:
+            concurrency = min(concurrency, quota)
+
+        self.save_progress(consts.SPLUNK_PROG_BATCH_CONCURRENCY, total=len(search_queries), concurrency=concurrency)
+
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            items = list(executor.map(lambda query: self._run_batch_query_item(query, po, max_runtime), search_queries))
+        duration = time.time() - start_time
+
+        successful = 0
+        for item in items:
+            action_result.add_data(item)
+            if item['status'] == 'success':
+                successful += 1
+
+        action_result.update_summary({
+            'total_queries': len(items),
+            'successful_queries': successful,
+            'failed_queries': len(items) - successful,
+            consts.SPLUNK_JSON_TOTAL_EVENTS: sum(item['total_events'] for item in items),
+            'concurrency': concurrency,
+            'duration': round(duration, 3)
+        })
+
+        if not successful:
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_BATCH_QUERY_FAILED)
+
+        return action_result.set_status(phantom.APP_SUCCESS, consts.SPLUNK_SUCC_BATCH_QUERY.format(successful=successful, total=len(items)))
 
     def _get_tz_str_from_epoch(self, time_format_str, epoch_milli):
 
@@ -846,107 +2015,453 @@ class SplunkConnector(BaseConnector):
         return action_result.get_status()
 
     def _test_asset_connectivity(self, param):
+        # A connectivity test is how the server gets checked again once it is back, so it is never refused by the breaker
+        self._circuit_breaker.record_success()
+
         if (phantom.is_fail(self._connect())):
             self.debug_print("connect failed")
             self.save_progress(consts.SPLUNK_ERR_CONNECTIVITY_TEST)
             return self.append_to_message(consts.SPLUNK_ERR_CONNECTIVITY_TEST)
 
-        version = self._get_server_version(self)
-        if version == 'FAILURE':
+        # Test connectivity is where the capabilities of a changed server get picked up, so they are always read again
+        ret_val, capabilities = self._get_server_capabilities(self, refresh=True)
+        if phantom.is_fail(ret_val):
             return self.append_to_message(consts.SPLUNK_ERR_CONNECTIVITY_TEST)
 
-        is_es = self._check_for_es(self)
-
-        self.save_progress("Detected Splunk {0}server version {1}".format("ES " if is_es else "", version))
+        self.save_progress("Detected Splunk {0}server version {1}".format("ES " if capabilities['es_installed'] else "", capabilities['version']))
 
         self.debug_print("connect passed")
         return self.set_status_save_progress(phantom.APP_SUCCESS, consts.SPLUNK_SUCC_CONNECTIVITY_TEST)
 
-    def _run_query(self, search_query, action_result, kwargs_create=dict(), parse_only=True):
-        """Function that executes the query on splunk"""
+    def _wait_for_job(self, job, action_result, max_wait=None, allow_partial=False, created=True):
+        """Wait for a search job to finish, backing off between status checks instead of spinning on the job
+
+        max_wait defaults to job_max_wait. With allow_partial, a job this action run created that is still
+        running once max_wait is over is finalized and the results found so far are returned. A job reused
+        from an identical query is never finalized, since other runs may be waiting on it, it is left
+        running and the wait fails instead. stats['finalized'] tells whether the job was finalized, by this
+        run or by another one.
+        """
+
+        if max_wait is None:
+            max_wait = self._job_max_wait
+
+        stats = {}
+
+        def check_job():
+            # is_ready() also loads the latest state of the job
+            if not self._call_splunk(job.is_ready):
+                return False, 0.0
+
+            stats.update({'is_done': job['isDone'],
+                          'dispatch_state': job['dispatchState'],
+                          'progress': float(job['doneProgress']) * 100,
+                          'scan_count': int(job['scanCount']),
+                          'event_count': int(job['eventCount']),
+                          'result_count': int(job['resultCount']),
+                          'finalized': job['isFinalized'] == '1'})
+            status = ("Progress: %(progress)03.1f%%   %(scan_count)d scanned   "
+                      "%(event_count)d matched   %(result_count)d results") % stats
+            self.send_progress(status)
+
+            done = stats['is_done'] == '1' or stats['dispatch_state'] in ('DONE', 'FAILED')
+            return done, stats['progress'] / 100
 
-        RETRY_LIMIT = int(self.get_config().get('retry_count', 3))
+        self.save_progress(consts.SPLUNK_PROG_WAITING_ON_JOB_ID, job_id=job.sid)
+        waiter = JobWaiter(consts.SPLUNK_DEFAULT_JOB_POLL_INTERVAL, self._job_poll_max_interval, max_wait)
+
+        try:
+            is_done = waiter.wait(check_job)
+
+            if not is_done and not created:
+                return RetVal(action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_REUSED_JOB_TIMEOUT.format(job_id=job.sid, max_wait=max_wait)), None)
+
+            if not is_done and allow_partial:
+                # Stop the search where it got to, Splunk then marks it as done with the results found so far
+                self.save_progress(consts.SPLUNK_PROG_FINALIZING_JOB, job_id=job.sid, max_wait=max_wait)
+                self._call_splunk(job.finalize)
+                waiter = JobWaiter(consts.SPLUNK_DEFAULT_JOB_POLL_INTERVAL, self._job_poll_max_interval, consts.SPLUNK_JOB_FINALIZE_MAX_WAIT)
+                is_done = waiter.wait(check_job)
+        except Exception as e:
+            return RetVal(action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_CONNECTION_FAILED, e), None)
+
+        if not is_done:
+            return RetVal(action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_JOB_TIMEOUT.format(job_id=job.sid, max_wait=max_wait)), None)
+
+        return RetVal(phantom.APP_SUCCESS, stats)
+
+    def _cancel_job(self, job):
+        """Cancel a search job this action run gave up on, so that it stops holding a search slot on the server"""
+
+        try:
+            job.cancel()
+            self.save_progress(consts.SPLUNK_PROG_CANCELLED_JOB, job_id=job.sid)
+        except Exception as e:
+            self.debug_print("Unable to cancel the search job {0}: {1}".format(job.sid, e))
+
+    def _cancel_job_on_error(self, job, results):
+        """Pass the results of a job through, cancelling the job if reading them fails"""
+
+        try:
+            for result in results:
+                yield result
+        except Exception:
+            self._cancel_job(job)
+            raise
+
+    def _get_job_reuse_key(self, search_query, kwargs_create):
+        key = json.dumps([self._get_config_fingerprint(), normalize_search_query(search_query), kwargs_create], sort_keys=True, default=str)
+        return hashlib.sha256(key.encode('UTF-8')).hexdigest()
+
+    def _get_job_reuse_lock(self, reuse_key):
+        if reuse_key is None:
+            return threading.Lock()
+
+        with self._job_reuse_lock:
+            return self._job_reuse_locks.setdefault(reuse_key, threading.Lock())
+
+    def _get_reusable_job(self, reuse_key):
+        """Return the job of an identical query created less than job_reuse_ttl seconds ago, if Splunk still has it
+
+        Jobs created by other action runs are found by reading the search jobs file again.
+        """
+
+        entry = self._search_jobs.get(reuse_key)
+        if entry is None:
+            with self._job_reuse_lock:
+                entry = self._load_search_jobs().get(reuse_key)
+
+        if not entry or entry['created_at'] + self._job_reuse_ttl <= time.time():
+            return None
+
+        try:
+            job = self._call_splunk(self._service.job, entry['sid'])
+        except Exception as e:
+            self.debug_print("Unable to reuse the search job {0}: {1}".format(entry['sid'], e))
+            return None
+
+        # A finalized job only holds the results found before its search was stopped
+        if job['isFailed'] == '1' or job['dispatchState'] == 'FAILED' or job['isFinalized'] == '1':
+            return None
+
+        return job
+
+    def _remember_job(self, reuse_key, sid):
+        """Record a new job in the search jobs file right away, so that identical queries of other action runs can use it"""
+
+        with self._job_reuse_lock:
+            now = time.time()
+            jobs = self._load_search_jobs()
+            jobs.update(self._search_jobs)
+            jobs[reuse_key] = {'sid': sid, 'created_at': now}
+            self._search_jobs = dict((k, v) for k, v in jobs.items() if v['created_at'] + self._job_reuse_ttl > now)
+            self._save_search_jobs(self._search_jobs)
+
+    def _get_search_jobs_path(self):
+        return os.path.join(self.get_state_dir(), '{}_search_jobs.json'.format(self.get_asset_id()))
+
+    def _load_search_jobs(self):
+        """Read the jobs recorded for reuse by the action runs of the asset, kept apart from the much larger state file"""
+
+        try:
+            with open(self._get_search_jobs_path()) as f:
+                jobs = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+        return jobs if isinstance(jobs, dict) else {}
+
+    def _save_search_jobs(self, jobs):
+        # Written aside and renamed, so that other action runs never read a partly written file
+        path = self._get_search_jobs_path()
+        try:
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(jobs, f)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            self.debug_print("Unable to save the search jobs file {}: {}".format(path, e))
+
+    def _iter_job_results(self, job, result_count=0, page_size=consts.SPLUNK_DEFAULT_RESULTS_PAGE_SIZE):
+        """Yield the results of a finished search job, fetching them one page at a time
+
+        When the result count is known to span several pages and result_fetch_concurrency is above 1,
+        the pages are downloaded concurrently and still yielded in order.
+        """
+
+        if self._result_fetch_concurrency > 1 and result_count > page_size:
+            for result in self._iter_job_results_concurrently(job, result_count, page_size):
+                yield result
+            return
+
+        offset = 0
+        while True:
+            page_rows = 0
+            for result in JSONResultsReader(self._call_splunk(job.results, output_mode='json', count=page_size, offset=offset)):
+                page_rows += 1
+                yield result
+
+            if page_rows < page_size:
+                return
+            offset += page_rows
+
+    def _iter_job_results_concurrently(self, job, result_count, page_size):
+        """Yield the results of a finished search job, downloading up to result_fetch_concurrency pages at a time
+
+        [0, result_count) is split in offset ranges of page_size rows. Only the pages being downloaded are
+        kept ahead of the one being yielded, so a large job never sits in memory as a whole.
+        """
+
+        offsets = iter(range(0, result_count, page_size))
+
+        with ThreadPoolExecutor(max_workers=self._result_fetch_concurrency) as executor:
+            pending = deque(executor.submit(self._fetch_results_page, job.sid, offset, page_size)
+                    for offset in islice(offsets, self._result_fetch_concurrency))
+
+            while pending:
+                page = pending.popleft().result()
+
+                next_offset = next(offsets, None)
+                if next_offset is not None:
+                    pending.append(executor.submit(self._fetch_results_page, job.sid, next_offset, page_size))
+
+                for result in page:
+                    yield result
+
+    def _fetch_results_page(self, sid, offset, count):
+        """Download one page of the results of a finished search job over the pooled session"""
+
+        config = self.get_config()
+        url = '{0}services/search/jobs/{1}/results'.format(self._base_url, sid)
+        params = {'output_mode': 'json', 'count': count, 'offset': offset}
+
+        response = self._send_request('get', url, params=params, auth=(config.get('username'), config.get('password')),
+                verify=config['verify_server_cert'], timeout=consts.SPLUNK_REST_TIMEOUTS[consts.SPLUNK_CALL_CLASS_RESULTS])
+        response.raise_for_status()
+
+        return list(JSONResultsReader(BytesIO(response.content)))
+
+    def _iter_export_results(self, stream, action_result, max_wait, allow_partial):
+        """Yield the final results of an export search as they arrive on the stream
+
+        The search is run with max_wait as its max_time, after which Splunk finalizes it and ends the
+        stream. A stream that only ends once max_wait is over is taken as finalized, which fails unless
+        allow_partial. The stream is closed however the reading stops, so that the connection and the
+        search on the server do not stay open.
+        """
+
+        deadline = time.time() + max_wait if max_wait else None
+        reader = JSONResultsReader(stream)
+        try:
+            for result in reader:
+                if not reader.is_preview:
+                    yield result
+
+            if deadline is not None and time.time() >= deadline:
+                if not allow_partial:
+                    raise Exception(consts.SPLUNK_ERR_EXPORT_TIMEOUT.format(max_wait=max_wait))
+                action_result.update_summary({consts.SPLUNK_JSON_FINALIZED: True})
+        finally:
+            stream.close()
+
+    def _start_query(self, search_query, action_result, kwargs_create=dict(), parse_only=True,
+            execution_mode=consts.SPLUNK_EXEC_MODE_NORMAL, reuse_job=False, max_runtime=None, allow_partial=False):
+        """Validate the query and start it on splunk
+
+        Returns a generator over the results along with the number of results, 0 if it is not known.
+        With the export execution mode the search is run through the streaming export endpoint,
+        results are parsed as they arrive and no search job is left behind on the server.
+        With reuse_job, the job of an identical query created less than job_reuse_ttl seconds ago
+        is used instead of a new one, whether it is still running or already done.
+        max_runtime and allow_partial are handed to _wait_for_job, or to _iter_export_results with the
+        export execution mode. Jobs created here are given
+        job_ttl as their lifetime on the server, and are cancelled when waiting on them or reading
+        their results fails.
+        """
 
         # Validate the search query
-        for attempt_count in range(0, RETRY_LIMIT):
-            try:
-                self._service.parse(search_query, parse_only=parse_only)
-                break
-            except HTTPError as e:
-                return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_INVALID_QUERY, e, query=search_query)
-            except Exception as e:
-                if attempt_count == RETRY_LIMIT - 1:
-                    return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_CONNECTION_FAILED, e)
+        try:
+            self._call_splunk(self._service.parse, search_query, parse_only=parse_only)
+        except HTTPError as e:
+            if is_retryable_error(e):
+                return RetVal(action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_CONNECTION_FAILED, e), None)
+            return RetVal(action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_INVALID_QUERY, e, query=search_query), None)
+        except Exception as e:
+            return RetVal(action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_CONNECTION_FAILED, e), None)
 
         self.debug_print(consts.SPLUNK_PROG_CREATED_QUERY.format(query=search_query))
 
-        # Creating search job
-        self.save_progress(consts.SPLUNK_PROG_CREATING_SEARCH_JOB)
-
-        # Set any search creation flags here
-        kwargs_create.update({'exec_mode': 'normal'})
+        if execution_mode == consts.SPLUNK_EXEC_MODE_EXPORT:
+            # Only final results are wanted, previews of transforming searches would show up as duplicates
+            kwargs_export = dict(kwargs_create, preview=False, output_mode='json')
+            max_wait = self._job_max_wait if max_runtime is None else max_runtime
+            if max_wait:
+                kwargs_export['max_time'] = max_wait
 
-        self.debug_print("kwargs_create", kwargs_create)
+            self.save_progress(consts.SPLUNK_PROG_EXPORTING_RESULTS)
+            self.debug_print("kwargs_export", kwargs_export)
 
-        # Create the job
-        for attempt_count in range(0, RETRY_LIMIT):
             try:
-                job = self._service.jobs.create(search_query, **kwargs_create)
-                break
+                stream = self._call_splunk(self._service.jobs.export, search_query, **kwargs_export)
             except Exception as e:
-                if attempt_count == RETRY_LIMIT - 1:
-                    return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_UNABLE_TO_CREATE_JOB, e)
+                return RetVal(action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_CONNECTION_FAILED, e), None)
 
-        result_count = 0
-        while True:
-            for attempt_count in range(0, RETRY_LIMIT):
-                try:
-                    while not job.is_ready():
-                        pass
-                    job.refresh()
-                    break
-                except Exception as e:
-                    if attempt_count == RETRY_LIMIT - 1:
-                        return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_CONNECTION_FAILED, e)
-
-            stats = {'is_done': job['isDone'],
-                     'progress': float(job['doneProgress']) * 100,
-                     'scan_count': int(job['scanCount']),
-                     'event_count': int(job['eventCount']),
-                     'result_count': int(job['resultCount'])}
-            status = ("Progress: %(progress)03.1f%%   %(scan_count)d scanned   "
-                      "%(event_count)d matched   %(result_count)d results") % stats
-            self.send_progress(status)
-            if stats['is_done'] == '1':
-                result_count = stats['result_count']
-                break
-            time.sleep(2)
+            # The number of results is not known up front when streaming
+            result_count = 0
+            results = self._iter_export_results(stream, action_result, max_wait, allow_partial)
+        else:
+            # Creating search job
+            self.save_progress(consts.SPLUNK_PROG_CREATING_SEARCH_JOB)
+
+            # Set any search creation flags here
+            kwargs_create = dict(kwargs_create, exec_mode='normal')
+
+            self.debug_print("kwargs_create", kwargs_create)
+
+            reuse_key = self._get_job_reuse_key(search_query, kwargs_create) if reuse_job and self._job_reuse_ttl else None
+
+            # Identical queries of this action run wait here for the first one to create the job
+            with self._get_job_reuse_lock(reuse_key):
+                job = self._get_reusable_job(reuse_key) if reuse_key else None
+                created = job is None
+
+                if job is not None:
+                    self.save_progress(consts.SPLUNK_PROG_REUSING_JOB, sid=job.sid)
+                    action_result.update_summary({'reused_sid': job.sid})
+                else:
+                    # Create the job
+                    try:
+                        job = self._call_splunk(self._service.jobs.create, search_query, **dict(kwargs_create, timeout=self._job_ttl))
+                    except Exception as e:
+                        return RetVal(action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_UNABLE_TO_CREATE_JOB, e), None)
+
+                    if reuse_key:
+                        self._remember_job(reuse_key, job.sid)
+
+            ret_val, stats = self._wait_for_job(job, action_result, max_runtime, allow_partial, created)
+            if phantom.is_fail(ret_val):
+                # A reused job is left alone, other action runs may still be waiting on it
+                if created:
+                    self._cancel_job(job)
+                return RetVal(action_result.get_status(), None)
+
+            if stats['finalized']:
+                action_result.update_summary({consts.SPLUNK_JSON_FINALIZED: True})
+
+            result_count = stats['result_count']
+            results = self._iter_job_results(job, result_count)
+            if created:
+                results = self._cancel_job_on_error(job, results)
+
+        return RetVal(phantom.APP_SUCCESS, (results, result_count))
+
+    def _run_query(self, search_query, action_result, kwargs_create=dict(), parse_only=True, max_rows=0, max_bytes=0,
+            execution_mode=consts.SPLUNK_EXEC_MODE_NORMAL, reuse_job=False, max_runtime=None, allow_partial=False, vault_rows=0):
+        """Function that executes the query on splunk
+
+        max_rows and max_bytes cap the results added to the action_result (0 for no limit).
+        When there are more than vault_rows results (0 for no limit), they are all written to a vault file
+        and the action_result only keeps a preview of them.
+        """
+
+        ret_val, query = self._start_query(search_query, action_result, kwargs_create, parse_only=parse_only, execution_mode=execution_mode,
+                reuse_job=reuse_job, max_runtime=max_runtime, allow_partial=allow_partial)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+        results, result_count = query
 
         self.send_progress("Parsing results...")
         result_index = 0
-        ten_percent = float(result_count) * 0.10
-        
+        ten_percent = max(int(result_count * 0.10), 1)
+        budget = ResultBudget(max_rows, max_bytes)
+        rows = []
+        spill = None
+
         try:
-            results = splunk_results.ResultsReader(job.results(count=0))
+            for result in budget.limit(results):
+
+                if spill is not None:
+                    spill.write(result)
+                elif vault_rows and len(rows) == vault_rows:
+                    # One result too many for the action_result, from now on they all go to a file
+                    self.save_progress(consts.SPLUNK_PROG_SPILLING_RESULTS, rows=vault_rows)
+                    spill = self._open_result_spill()
+                    for row in rows:
+                        spill.write(row)
+                    spill.write(result)
+                else:
+                    rows.append(result)
+
+                result_index += 1
+
+                if result_count and (result_index % ten_percent) == 0:
+                    status = "Finished parsing {0:.1%} of results".format((float(result_index) / float(result_count)))
+                    self.send_progress(status)
         except Exception as e:
+            if spill is not None:
+                spill.close()
+                os.remove(spill.path)
             return action_result.set_status(phantom.APP_ERROR, "Error retrieving results", e)
-        
-        for result in results:
+        finally:
+            # The budget may stop reading before the end of the results
+            results.close()
 
-            if isinstance(result, dict):
+        if budget.truncated:
+            self.save_progress(consts.SPLUNK_PROG_RESULTS_TRUNCATED, rows=result_index)
 
-                action_result.add_data(result)
+        action_result.update_summary({consts.SPLUNK_JSON_TOTAL_EVENTS: result_index, consts.SPLUNK_JSON_TRUNCATED: budget.truncated})
 
-            result_index += 1
+        if spill is not None:
+            spill.close()
+            return self._add_result_spill_to_vault(action_result, spill, rows[:consts.SPLUNK_VAULT_PREVIEW_ROWS])
+
+        for row in rows:
+            action_result.add_data(row)
 
-            if (result_index % ten_percent) == 0:
-                status = "Finished parsing {0:.1%} of results".format((float(result_index) / float(result_count)))
-                self.send_progress(status)
-        
-        action_result.update_summary({consts.SPLUNK_JSON_TOTAL_EVENTS: result_index})
-        
         return action_result.set_status(phantom.APP_SUCCESS)
 
+    def _open_result_spill(self):
+        """Open a gzip JSON lines file for results in the vault temporary directory"""
+
+        if hasattr(Vault, 'get_vault_tmp_dir'):
+            tmp_dir = Vault.get_vault_tmp_dir()
+        else:
+            tmp_dir = '/opt/phantom/vault/tmp'
+
+        fd, path = tempfile.mkstemp(suffix='.jsonl.gz', dir=tmp_dir)
+        os.close(fd)
+
+        return JSONLinesSpill(path)
+
+    def _add_result_spill_to_vault(self, action_result, spill, preview):
+        """Add a file of results to the vault, keeping a description and a preview of them in the action_result"""
+
+        file_name = 'splunk_results_{0}.jsonl.gz'.format(datetime.utcnow().strftime('%Y%m%dT%H%M%SZ'))
+        metadata = {'contains': ['splunk results'], 'size': os.path.getsize(spill.path)}
+
+        try:
+            vault_ret = Vault.add_attachment(spill.path, self.get_container_id(), file_name=file_name, metadata=metadata)
+        except Exception as e:
+            vault_ret = {'succeeded': False, 'message': str(e)}
+        finally:
+            if os.path.exists(spill.path):
+                os.remove(spill.path)
+
+        if not vault_ret.get('succeeded'):
+            return action_result.set_status(phantom.APP_ERROR, consts.SPLUNK_ERR_VAULT_ADD.format(message=vault_ret.get('message')))
+
+        for row in preview:
+            action_result.add_data(row)
+
+        action_result.update_summary({
+            consts.SPLUNK_JSON_VAULT_ID: vault_ret[phantom.APP_JSON_HASH],
+            'vault_file_name': file_name,
+            'fields': sorted(spill.fields),
+            'preview_rows': len(preview)
+        })
+
+        return action_result.set_status(phantom.APP_SUCCESS, consts.SPLUNK_SUCC_RESULTS_IN_VAULT.format(rows=spill.rows))
+
     def handle_action(self, param):
         """Function that handles all the actions
 
@@ -963,6 +2478,8 @@ class SplunkConnector(BaseConnector):
         self.send_progress("executing action: " + action)
         if action == self.ACTION_ID_RUN_QUERY:
             result = self._handle_run_query(param)
+        elif action == self.ACTION_ID_RUN_BATCH_QUERY:
+            result = self._handle_run_batch_query(param)
         elif action == self.ACTION_ID_POST_DATA:
             result = self._post_data(param)
         elif action == self.ACTION_ID_UPDATE_EVENT:
@@ -977,6 +2494,12 @@ class SplunkConnector(BaseConnector):
             result = self._add_record_kvstore(param)
         elif action == "delete_kvstore_data":
             result = self._delete_record_kvstore(param)
+        elif action == "delete_kvstore_data_by_query":
+            result = self._delete_records_by_query_kvstore(param)
+        elif action == "get_kvstore_data":
+            result = self._get_records_kvstore(param)
+        elif action == "lookup_kvstore_data":
+            result = self._lookup_kvstore(param)
 
         return result
 
@@ -11,16 +11,35 @@ SPLUNK_SUCC_QUERY_EXECUTED = "Executed splunk query"
 SPLUNK_ERR_BAD_STATUS = "The supplied status is invalid"
 SPLUNK_ERR_CONNECTIVITY_TEST = "Connectivity test failed"
 SPLUNK_SUCC_CONNECTIVITY_TEST = "Connectivity test passed"
+SPLUNK_SUCC_BATCH_QUERY = "Executed {successful} of {total} queries"
+SPLUNK_SUCC_HEC_POSTED = "Successfully posted {events} events in {batches} batches"
+SPLUNK_SUCC_RESULTS_IN_VAULT = "Added {rows} results to the vault"
 SPLUNK_ERR_NOT_JSON = "Splunk server response was not JSON"
 SPLUNK_ERR_NOT_200 = "Splunk server returned error from API call"
 SPLUNK_ERR_CONNECTION_FAILED = "Failed to connect to splunk server"
 SPLUNK_ERR_UNABLE_TO_CREATE_JOB = "Failed to get a job id from splunk server"
 SPLUNK_ERR_GET_EVENTS = "Error getting events for alert '{ss_name}' having sid '{sid}'"
 SPLUNK_ERR_NOT_ES = "This instance does not seem to be Splunk ES. This action cannot be run"
+SPLUNK_ERR_ES_CHECK_FAILED = "Unable to check whether Splunk Enterprise Security is installed: {message}"
 SPLUNK_ERR_CONNECTION_NOT_PRE_ESTABLISHED = "Connection to splunk server not yet established"
 SPLUNK_ERR_INVALID_TIME_RANGE = "Invalid Time range specified, where the end time is less than start time"
 SPLUNK_ERR_NEED_PARAM = "One of comment, status, integer_status, urgency, or owner parameters needs to be supplied to run this action"
 SPLUNK_ERR_INVALID_PARAM = "Please provide non-zero positive integer in {param}"
+SPLUNK_ERR_INVALID_NON_NEGATIVE_PARAM = "Please provide a positive integer or zero in {param}"
+SPLUNK_ERR_INVALID_EXEC_MODE = "Please provide a valid value in the 'execution_mode' action parameter. Valid values: {modes}"
+SPLUNK_ERR_INVALID_EVENTS = "Please provide a non-empty JSON list of events in the 'data' action parameter"
+SPLUNK_ERR_HEC_FAILED = "The HTTP Event Collector rejected the events. Status code: {status}. Message: {message}"
+SPLUNK_ERR_KVSTORE_CHUNKS_FAILED = "Unable to save {failed} of {total} chunks ({records} records) to the KV store. Last error: {message}"
+SPLUNK_ERR_KVSTORE_EMPTY_QUERY = "Please provide a non-empty JSON object in the 'query' action parameter, an empty query would delete every record of the collection"
+SPLUNK_ERR_KVSTORE_NO_VALUES = "Please provide a comma-separated list of values in the 'values' action parameter"
+SPLUNK_ERR_KVSTORE_LIMIT = "Please provide a 'limit' of at most {max}, the most records the KV store returns for one query"
+SPLUNK_ERR_KVSTORE_SNAPSHOT = "Error using the local snapshot of the KV store collection"
+SPLUNK_ERR_VAULT_ADD = "Unable to add the results to the vault: {message}"
+SPLUNK_ERR_INVALID_QUERIES = "Please provide a JSON list of queries or one query per line in the 'queries' action parameter"
+SPLUNK_ERR_BATCH_QUERY_FAILED = "All the queries of the batch failed"
+SPLUNK_ERR_JOB_TIMEOUT = "Search job (id:{job_id}) did not finish within {max_wait} seconds"
+SPLUNK_ERR_EXPORT_TIMEOUT = "The export search did not finish within {max_wait} seconds"
+SPLUNK_ERR_REUSED_JOB_TIMEOUT = "Search job (id:{job_id}) of an identical query did not finish within {max_wait} seconds, it is left running for the action runs sharing it"
 
 # Progress messages
 SPLUNK_PROG_GOT_JOB_ID = "Got job id '{job_id}'"
@@ -28,8 +47,21 @@ SPLUNK_PROG_TIME_RANGE = "Using range '{range}'"
 SPLUNK_PROG_CREATED_QUERY = "Created query '{query}'"
 SPLUNK_PROG_CREATING_SEARCH_JOB = "Creating search job"
 SPLUNK_PROG_WAITING_ON_JOB_ID = "Waiting for job (id:{job_id}) to finish"
+SPLUNK_PROG_FINALIZING_JOB = "Search job (id:{job_id}) did not finish within {max_wait} seconds, finalizing it to return the results found so far"
+SPLUNK_PROG_CANCELLED_JOB = "Cancelled search job (id:{job_id})"
+SPLUNK_PROG_SPILLING_RESULTS = "More than {rows} results, writing them to a vault file"
 SPLUNK_PROG_CHECKING_STATUS_OF_JOB_ID = "Checking status of job id '{job_id}'"
 SPLUNK_PROG_JOB_ID_DONE_RETRIEVING_RESULTS = "Retrieving results for job id '{job_id}'"
+SPLUNK_PROG_EXPORTING_RESULTS = "Streaming results from the export endpoint"
+SPLUNK_PROG_BATCH_CONCURRENCY = "Running {total} queries, {concurrency} at a time"
+SPLUNK_PROG_BACKFILL = "Backfilling {slices} index time slices of {seconds} seconds, {concurrency} at a time"
+SPLUNK_PROG_PIPELINE = "Ingesting results while they are downloaded, in chunks of {chunk_size} with up to {queue_size} chunks queued per stage"
+SPLUNK_PROG_BACKFILL_SLICE_CAPPED = "The one second index time slice {earliest} - {latest} returned {max_count} results, any more of its results are skipped"
+SPLUNK_PROG_BACKFILL_SLICE_FAILED = "Backfill of the index time slice {earliest} - {latest} failed, the later slices are left to the next poll: {message}"
+SPLUNK_PROG_KVSTORE_CHUNKS = "Saving {records} records to the KV store in {chunks} chunks, {concurrency} at a time"
+SPLUNK_PROG_KVSTORE_SNAPSHOT_LOAD = "Loading the local snapshot of the KV store collection"
+SPLUNK_PROG_REUSING_JOB = "Reusing the search job {sid} of an identical query"
+SPLUNK_PROG_RESULTS_TRUNCATED = "Result budget reached after {rows} results, the remaining results were dropped"
 
 # Json keys
 SPLUNK_JSON_COMMAND = "command"
@@ -53,16 +85,92 @@ SPLUNK_JSON_SOURCE_TYPE = "source_type"
 SPLUNK_JSON_LAST_N_DAYS = "last_n_days"
 SPLUNK_JSON_TOTAL_EVENTS = "total_events"
 SPLUNK_JSON_UPDATED_EVENT_ID = "updated_event_id"
+SPLUNK_JSON_TRUNCATED = "truncated"
+SPLUNK_JSON_FINALIZED = "finalized"
+SPLUNK_JSON_VAULT_ID = "vault_id"
+SPLUNK_JSON_MAX_RUNTIME = "max_runtime"
+SPLUNK_JSON_EXECUTION_MODE = "execution_mode"
+SPLUNK_JSON_QUERIES = "queries"
+SPLUNK_JSON_MAX_CONCURRENCY = "max_concurrency"
+SPLUNK_JSON_MULTIPLE_EVENTS = "multiple_events"
 
 # Default values
 SPLUNK_DEFAULT_EVENT_COUNT = 10
 SPLUNK_DEFAULT_ALERT_COUNT = 100
 SPLUNK_DEFAULT_SOURCE = "Phantom"
 SPLUNK_DEFAULT_SOURCE_TYPE = "Automation/Orchestration Platform"
+SPLUNK_DEFAULT_JOB_POLL_INTERVAL = 0.25
+SPLUNK_DEFAULT_JOB_POLL_MAX_INTERVAL = 5
+SPLUNK_DEFAULT_JOB_MAX_WAIT = 0
+SPLUNK_DEFAULT_JOB_TTL = 600
+SPLUNK_DEFAULT_RETRY_COUNT = 3
+SPLUNK_RETRY_INITIAL_DELAY = 1
+SPLUNK_RETRY_MAX_DELAY = 30
+SPLUNK_DEFAULT_CIRCUIT_BREAKER_THRESHOLD = 5
+SPLUNK_DEFAULT_CIRCUIT_BREAKER_RESET = 60
+# Seconds a finalized job is given to wrap up before it is cancelled
+SPLUNK_JOB_FINALIZE_MAX_WAIT = 60
+# Results kept in the action result when they are written to a vault file
+SPLUNK_VAULT_PREVIEW_ROWS = 10
+SPLUNK_DEFAULT_RESULTS_PAGE_SIZE = 10000
+SPLUNK_DEFAULT_RESULT_FETCH_CONCURRENCY = 1
+SPLUNK_DEFAULT_CONNECTION_POOL_SIZE = 10
+SPLUNK_DEFAULT_BATCH_CONCURRENCY = 4
+SPLUNK_DEFAULT_INGEST_BATCH_SIZE = 100
+SPLUNK_DEFAULT_DEDUPE_INDEX_SIZE = 10000
+SPLUNK_DEFAULT_BACKFILL_SLICE_SECONDS = 0
+SPLUNK_DEFAULT_BACKFILL_CONCURRENCY = 4
+SPLUNK_DEFAULT_HEC_PORT = 8088
+SPLUNK_DEFAULT_HEC_BATCH_SIZE = 100
+SPLUNK_DEFAULT_HEC_BATCH_BYTES = 1000000
+# Splunk rejects batch_save requests of more than 1000 documents by default
+SPLUNK_DEFAULT_KVSTORE_BATCH_SIZE = 1000
+SPLUNK_DEFAULT_KVSTORE_BATCH_BYTES = 10000000
+SPLUNK_DEFAULT_KVSTORE_CONCURRENCY = 4
+SPLUNK_DEFAULT_KVSTORE_PAGE_SIZE = 1000
+SPLUNK_DEFAULT_KVSTORE_SNAPSHOT_TTL = 300
+# Snapshots are loaded from scratch once a day, to catch changes no modtime field tells about
+SPLUNK_KVSTORE_SNAPSHOT_MAX_AGE = 86400
+# Seconds a lookup waits for another run to finish refreshing the same snapshot
+SPLUNK_KVSTORE_SNAPSHOT_LOCK_TIMEOUT = 600
+SPLUNK_KVSTORE_KEYS_PER_QUERY = 100
+# Default max_rows_per_query of the KV store in limits.conf
+SPLUNK_KVSTORE_MAX_ROWS_PER_QUERY = 50000
+# Further slices are left to the next polls
+SPLUNK_MAX_BACKFILL_SLICES = 48
+SPLUNK_PIPELINE_CHUNK_SIZE = 1000
+SPLUNK_PIPELINE_QUEUE_SIZE = 4
+# Kept below the default Splunk session timeout of one hour
+SPLUNK_SESSION_KEY_TTL = 3000
+SPLUNK_CAPABILITIES_TTL = 3600
+SPLUNK_NOTABLE_UPDATE_BATCH_SIZE = 1000
+# The event_id of a notable never changes, resolved ones are kept for a day
+SPLUNK_EVENT_ID_CACHE_TTL = 86400
+SPLUNK_EVENT_ID_CACHE_SIZE = 1000
+
+# Search execution modes
+SPLUNK_EXEC_MODE_NORMAL = "normal"
+SPLUNK_EXEC_MODE_EXPORT = "export"
+SPLUNK_EXEC_MODES = [SPLUNK_EXEC_MODE_NORMAL, SPLUNK_EXEC_MODE_EXPORT]
+
+# REST call classes and their (connect, read) timeouts in seconds
+SPLUNK_CALL_CLASS_DEFAULT = "default"
+SPLUNK_CALL_CLASS_METADATA = "metadata"
+SPLUNK_CALL_CLASS_INGEST = "ingest"
+SPLUNK_CALL_CLASS_KVSTORE = "kvstore"
+SPLUNK_CALL_CLASS_NOTABLE = "notable"
+SPLUNK_CALL_CLASS_RESULTS = "results"
+SPLUNK_REST_TIMEOUTS = {
+    SPLUNK_CALL_CLASS_DEFAULT: (10, 120),
+    SPLUNK_CALL_CLASS_METADATA: (10, 30),
+    SPLUNK_CALL_CLASS_INGEST: (10, 120),
+    SPLUNK_CALL_CLASS_KVSTORE: (10, 300),
+    SPLUNK_CALL_CLASS_NOTABLE: (10, 120),
+    SPLUNK_CALL_CLASS_RESULTS: (10, 300)
+}
 
 # HTML search strings:
 SPLUNK_POST_DATA_WARN = '<msg type="WARN">'
-SPLUNK_SERVER_VERSION = '<s:key name="version">'
 SPLUNK_ES_NAME = '<title>SA-EndpointProtection</title>'
 
 # Numeric constants
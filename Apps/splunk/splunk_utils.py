@@ -0,0 +1,651 @@
+# File: splunk_utils.py
+# Copyright (c) 2014-2020 Splunk Inc.
+#
+# SPLUNK CONFIDENTIAL - Use or disclosure of this material in whole or in part
+# without a valid written license from Splunk Inc. is PROHIBITED.
+# --
+
+# Helpers used by the connector that do not depend on the Phantom platform
+
+import codecs
+import contextlib
+import errno
+import gzip
+import json
+import random
+import socket
+import sqlite3
+import ssl
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import requests
+
+try:
+    string_types = basestring  # noqa
+except NameError:
+    string_types = str
+
+try:
+    connection_errors = (ConnectionError,)
+except NameError:
+    connection_errors = ()
+
+
+class JobWaiter(object):
+    """Paces the status checks of a running Splunk search job
+
+    Checks start out frequent, so that short searches return quickly, and back off
+    exponentially (with jitter) up to max_interval, so that long running searches
+    do not keep the connector busy. Once the job gets close to completion the
+    interval drops back to initial_interval, so that the job is picked up soon
+    after Splunk marks it as done.
+    """
+
+    NEAR_DONE_PROGRESS = 0.9
+
+    def __init__(self, initial_interval, max_interval, max_wait=0, factor=2.0, jitter=0.2,
+                 sleep=time.sleep, clock=time.time):
+        self._initial_interval = float(initial_interval)
+        self._max_interval = max(float(max_interval), self._initial_interval)
+        self._max_wait = max_wait
+        self._factor = factor
+        self._jitter = jitter
+        self._sleep = sleep
+        self._clock = clock
+
+    def wait(self, check):
+        """Call check() until it reports the job as done
+
+        check() must return a (done, progress) tuple, progress being a float between 0 and 1.
+        Returns True once the job is done and False if max_wait elapsed before that.
+        """
+        deadline = (self._clock() + self._max_wait) if self._max_wait else None
+        interval = self._initial_interval
+
+        while True:
+            done, progress = check()
+            if done:
+                return True
+
+            if progress >= self.NEAR_DONE_PROGRESS:
+                interval = self._initial_interval
+
+            delay = interval * random.uniform(1 - self._jitter, 1)
+            if deadline is not None:
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    return False
+                delay = min(delay, remaining)
+
+            self._sleep(delay)
+            interval = min(interval * self._factor, self._max_interval)
+
+
+# HTTP statuses of a busy or failing server, as opposed to those of a request that is wrong
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+# Errors of a certificate or of a URL that is wrong, which derive from the retryable ones below
+FATAL_ERRORS = (ssl.SSLError, ssl.CertificateError, requests.exceptions.SSLError, requests.exceptions.InvalidURL,
+                requests.exceptions.MissingSchema, requests.exceptions.InvalidSchema)
+RETRYABLE_ERRORS = (socket.timeout, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError) + connection_errors
+# Socket errors of a connection that was refused, dropped or timed out, for Python 2 which has no ConnectionError
+RETRYABLE_ERRNOS = (errno.ECONNREFUSED, errno.ECONNRESET, errno.ECONNABORTED, errno.EPIPE, errno.ETIMEDOUT)
+
+
+def is_retryable_error(error):
+    """Tell whether a failed call to Splunk is worth another attempt
+
+    HTTP errors are retryable when their status says the server is busy or failing,
+    connection errors, timeouts and reset sockets always are. Anything else, such as
+    a rejected query, bad credentials, a bad certificate or a bad URL, would fail
+    again the same way.
+    """
+
+    status = getattr(error, 'status', None)
+    if status is None and getattr(error, 'response', None) is not None:
+        status = getattr(error.response, 'status_code', None)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+
+    if isinstance(error, FATAL_ERRORS):
+        return False
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return isinstance(error, (IOError, OSError)) and getattr(error, 'errno', None) in RETRYABLE_ERRNOS
+
+
+class RetryPolicy(object):
+    """Calls a function again when it fails with a retryable error
+
+    attempts is the total number of calls made. The delay between them starts at
+    initial_delay and doubles up to max_delay, with jitter so that concurrent
+    callers do not retry in lockstep. Errors that is_retryable rejects are raised
+    right away.
+    """
+
+    def __init__(self, attempts, initial_delay=1.0, max_delay=30.0, factor=2.0, jitter=0.5,
+                 is_retryable=is_retryable_error, sleep=time.sleep):
+        self._attempts = max(int(attempts), 1)
+        self._initial_delay = float(initial_delay)
+        self._max_delay = float(max_delay)
+        self._factor = factor
+        self._jitter = jitter
+        self._is_retryable = is_retryable
+        self._sleep = sleep
+
+    def delays(self):
+        """Yield the pause to make before each attempt after the first one"""
+
+        delay = self._initial_delay
+        for _ in range(self._attempts - 1):
+            yield delay * random.uniform(1 - self._jitter, 1)
+            delay = min(delay * self._factor, self._max_delay)
+
+    def call(self, func, *args, **kwargs):
+        delays = self.delays()
+
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                delay = next(delays, None)
+                if delay is None or not self._is_retryable(e):
+                    raise
+
+            self._sleep(delay)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a server whose circuit is open"""
+
+    def __init__(self, failures, retry_in):
+        super(CircuitOpenError, self).__init__(
+            "The server failed {0} times in a row, calls to it are paused for {1} more seconds".format(failures, retry_in))
+        self.failures = failures
+        self.retry_in = retry_in
+
+
+class CircuitBreaker(object):
+    """Stops calls to a server that keeps failing
+
+    After failure_threshold failures in a row the circuit opens, and calls are
+    refused for reset_timeout seconds. Calls are then let through again, the
+    first success closes the circuit and the next failure opens it again.
+    The breaker works on the state dict it is given, so that it can be persisted
+    between action runs, under lock when the owner of the dict gives one.
+    A failure_threshold of 0 disables it.
+    """
+
+    def __init__(self, state, failure_threshold, reset_timeout, clock=time.time, lock=None):
+        self._state = state
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = lock or threading.Lock()
+
+    def check(self):
+        """Raise CircuitOpenError if calls are not allowed right now"""
+
+        if not self._failure_threshold:
+            return
+
+        with self._lock:
+            opened_at = self._state.get('opened_at')
+            if opened_at is None:
+                return
+            remaining = opened_at + self._reset_timeout - self._clock()
+            if remaining > 0:
+                raise CircuitOpenError(self._state.get('failures', 0), int(remaining) + 1)
+
+    def record_success(self):
+        with self._lock:
+            self._state.pop('failures', None)
+            self._state.pop('opened_at', None)
+
+    def record_failure(self):
+        with self._lock:
+            self._state['failures'] = self._state.get('failures', 0) + 1
+            if self._failure_threshold and self._state['failures'] >= self._failure_threshold:
+                self._state['opened_at'] = self._clock()
+
+
+class ResultBudget(object):
+    """Caps a stream of result rows by row count and by approximate serialized size
+
+    A limit of 0 means no limit. After limit() has been consumed, truncated tells
+    whether rows were dropped because one of the limits was reached.
+    """
+
+    def __init__(self, max_rows=0, max_bytes=0):
+        self._max_rows = max_rows
+        self._max_bytes = max_bytes
+        self.rows = 0
+        self.bytes = 0
+        self.truncated = False
+
+    def limit(self, results):
+        for result in results:
+            if self._max_rows and self.rows >= self._max_rows:
+                self.truncated = True
+                return
+
+            if self._max_bytes:
+                size = len(json.dumps(result))
+                if self.bytes + size > self._max_bytes:
+                    self.truncated = True
+                    return
+                self.bytes += size
+
+            self.rows += 1
+            yield result
+
+
+def iter_batches(items, max_count=0, max_bytes=0, size=len):
+    """Group items into lists of at most max_count items whose size() adds up to at most max_bytes
+
+    A limit of 0 means no limit. An item that is larger than max_bytes on its own
+    is put in a batch of its own rather than dropped.
+    """
+
+    batch = []
+    batch_bytes = 0
+    for item in items:
+        item_bytes = size(item) if max_bytes else 0
+        if batch and ((max_count and len(batch) >= max_count) or (max_bytes and batch_bytes + item_bytes > max_bytes)):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(item)
+        batch_bytes += item_bytes
+
+    if batch:
+        yield batch
+
+
+def normalize_search_query(query):
+    """Collapse the whitespace of a search query outside of quoted strings
+
+    Two queries that only differ by their layout normalize to the same string,
+    while the whitespace inside quotes, which can change what is matched, is kept.
+    """
+
+    parts = []
+    quoted = False
+    escaped = False
+    pending_space = False
+    for char in query.strip():
+        if quoted:
+            parts.append(char)
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                quoted = False
+            continue
+
+        if char.isspace():
+            pending_space = True
+            continue
+
+        if pending_space:
+            parts.append(' ')
+            pending_space = False
+        parts.append(char)
+        if char == '"':
+            quoted = True
+
+    return ''.join(parts)
+
+
+def gzip_compress(data):
+    """Compress bytes to the gzip format"""
+
+    # wbits of 16 + MAX_WBITS writes the gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class JSONLinesSpill(object):
+    """Writes result rows to a gzip compressed file, one JSON document per line
+
+    The number of rows written and the names of the fields found in them are
+    kept, so that the file can be described without reading it back.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.fields = set()
+        self._file = gzip.open(path, 'wb')
+
+    def write(self, row):
+        self._file.write((json.dumps(row) + '\n').encode('utf-8'))
+        self.rows += 1
+        self.fields.update(row)
+
+    def close(self):
+        self._file.close()
+
+
+class BoundedSeenSet(object):
+    """Set of identifiers that forgets the oldest ones once it holds max_size of them
+
+    Identifiers are hex digests, only their first KEY_LENGTH characters are kept
+    so that the persisted form of the set stays compact.
+    """
+
+    KEY_LENGTH = 16
+
+    def __init__(self, max_size, keys=None):
+        self._max_size = max_size
+        self._keys = OrderedDict.fromkeys(keys or [])
+        self._trim()
+
+    def __contains__(self, identifier):
+        return identifier[:self.KEY_LENGTH] in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, identifier):
+        key = identifier[:self.KEY_LENGTH]
+        self._keys.pop(key, None)
+        self._keys[key] = None
+        self._trim()
+
+    def keys(self):
+        return list(self._keys)
+
+    def _trim(self):
+        while len(self._keys) > self._max_size:
+            self._keys.popitem(last=False)
+
+
+class CEFMappingPlan(object):
+    """Maps the results of a poll to artifact CEF fields and container names
+
+    The mapping is compiled once from the field names found in the results, the
+    fields to display and the container name settings, so that applying it to a
+    result is a single pass over precomputed keys.
+    """
+
+    def __init__(self, cim_cef_map, fields, display_fields=None, name_prefix='', name_values=None):
+        self._cim_cef_map = cim_cef_map
+
+        # CEF keys and the result keys they are read from, None to map every field of the results
+        self._cef_keys = None
+        self._result_keys = None
+        self._header_set = None
+        if display_fields:
+            header_set = {x.strip().lower() for x in display_fields}
+            # Use this to keep the original capitalization from splunk
+            name_mappings = {}
+            case_variants = False
+            for field in fields:
+                if field.lower() in header_set:
+                    case_variants = case_variants or field.lower() in name_mappings
+                    name_mappings[field.lower()] = field
+            if case_variants:
+                # Fields differing only by case, such as Src and src, are told apart result by result
+                self._header_set = header_set
+            else:
+                self._cef_keys = [name_mappings.get(cim_cef_map.get(h, h), h) for h in header_set]
+                self._result_keys = [name_mappings.get(h, h) for h in header_set]
+
+        # Fields that get a different name in CEF. Unless two fields end up with the same
+        # CEF name, a result is mapped by copying it and renaming just these fields.
+        self._renamed = [(field, cim_cef_map[field]) for field in fields if cim_cef_map.get(field, field) != field]
+        cef_names = [cef_name for _, cef_name in self._renamed]
+        self._rename_only = len(set(cef_names)) == len(cef_names) and not set(cef_names).intersection(fields)
+
+        self._name_prefix = name_prefix
+        name_values = list(name_values or [])
+        if not name_prefix and not name_values:
+            name_values = ['source']
+        self._name_keys = [cim_cef_map.get(value, value) for value in name_values]
+
+    def cef(self, result):
+        if self._header_set is not None:
+            name_mappings = {}
+            for field in result:
+                if field.lower() in self._header_set:
+                    name_mappings[field.lower()] = field
+            return dict((name_mappings.get(self._cim_cef_map.get(h, h), h), result.get(name_mappings.get(h, h))) for h in self._header_set)
+
+        if self._cef_keys is not None:
+            return dict(zip(self._cef_keys, map(result.get, self._result_keys)))
+
+        if self._rename_only:
+            cef = dict(result)
+            for field, cef_name in self._renamed:
+                if field in cef:
+                    cef[cef_name] = cef.pop(field)
+            return cef
+
+        cim_cef_get = self._cim_cef_map.get
+        return dict(zip(map(cim_cef_get, result, result), result.values()))
+
+    def name(self, result):
+        values = ''
+        last = len(self._name_keys) - 1
+        for i, key in enumerate(self._name_keys):
+            value = result.get(key)
+            if value:
+                values += "{}{}".format(value, '' if i == last else ', ')
+
+        title = self._name_prefix
+        if not title:
+            time = result.get('_time')
+            if time:
+                title = "Splunk Log Entry on {}".format(time)
+            else:
+                title = "Splunk Log Entry"
+        else:
+            title = result.get(title, title)
+
+        return "{}: {}".format(title, values)
+
+
+class KVStoreSnapshot(object):
+    """Local SQLite copy of a KV store collection, indexed by field value for lookups
+
+    Every top-level value of a record is indexed as text, strings as they are and
+    other values JSON encoded, the elements of lists being indexed one by one.
+    The meta table keeps the bookkeeping of the refreshes, a snapshot that is not
+    marked as valid has to be loaded again from scratch.
+
+    Every change is made in its own transaction, unless it is made inside transaction(),
+    which holds the write lock of the database file until it is done. timeout is how
+    long to wait for a lock held by another run.
+    """
+
+    def __init__(self, path, timeout=30):
+        # Transactions are begun and committed explicitly, see _write
+        self._conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self._in_transaction = False
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS records (key TEXT PRIMARY KEY, record TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS record_values (key TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS record_values_lookup ON record_values (field, value);
+            CREATE INDEX IF NOT EXISTS record_values_key ON record_values (key);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+        """)
+
+    def close(self):
+        self._conn.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Make the changes of the block in one transaction, which other runs wait for
+
+        Other runs keep reading the last committed snapshot until the block is done.
+        The block is rolled back if it raises or calls discard().
+        """
+
+        if self._in_transaction:
+            raise RuntimeError("The snapshot is already in a transaction")
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._in_transaction = True
+        self._discard = False
+        try:
+            yield self
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        else:
+            self._conn.execute("ROLLBACK" if self._discard else "COMMIT")
+        finally:
+            self._in_transaction = False
+
+    def discard(self):
+        """Roll back the current transaction when it ends, instead of committing it"""
+
+        self._discard = True
+
+    @contextlib.contextmanager
+    def _write(self):
+        if self._in_transaction:
+            yield
+            return
+
+        with self.transaction():
+            yield
+
+    def get_meta(self, name, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, **values):
+        with self._write():
+            self._conn.executemany("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                                   [(name, json.dumps(value)) for name, value in values.items()])
+
+    def is_valid(self):
+        return self.get_meta('valid', False)
+
+    def invalidate(self):
+        self.set_meta(valid=False)
+
+    def clear(self):
+        with self._write():
+            self._conn.execute("DELETE FROM records")
+            self._conn.execute("DELETE FROM record_values")
+
+    def count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def keys(self):
+        return set(row[0] for row in self._conn.execute("SELECT key FROM records"))
+
+    def upsert(self, records):
+        records = [record for record in records if record.get('_key') is not None]
+        with self._write():
+            self._delete_values([record['_key'] for record in records])
+            self._conn.executemany("INSERT OR REPLACE INTO records (key, record) VALUES (?, ?)",
+                                   [(record['_key'], json.dumps(record)) for record in records])
+            self._conn.executemany("INSERT INTO record_values (key, field, value) VALUES (?, ?, ?)",
+                                   [(record['_key'], field, value) for record in records for field, value in self._iter_values(record)])
+
+    def delete(self, keys):
+        keys = list(keys)
+        with self._write():
+            self._delete_values(keys)
+            self._conn.executemany("DELETE FROM records WHERE key = ?", [(key,) for key in keys])
+
+    def lookup(self, field, values):
+        """Return the records whose field holds one of values"""
+
+        records = []
+        values = list(values)
+        # Stay below the number of variables SQLite accepts in one statement
+        for i in range(0, len(values), 500):
+            chunk = values[i:i + 500]
+            rows = self._conn.execute(
+                "SELECT record FROM records WHERE key IN "
+                "(SELECT key FROM record_values WHERE field = ? AND value IN ({})) ORDER BY key".format(','.join('?' * len(chunk))),
+                [field] + chunk)
+            records.extend(json.loads(row[0]) for row in rows)
+        return records
+
+    def _delete_values(self, keys):
+        self._conn.executemany("DELETE FROM record_values WHERE key = ?", [(key,) for key in keys])
+
+    @staticmethod
+    def _iter_values(record):
+        for field, value in record.items():
+            for item in (value if isinstance(value, list) else [value]):
+                if item is None:
+                    continue
+                yield field, item if isinstance(item, string_types) else json.dumps(item)
+
+
+class JSONResultsReader(object):
+    """Iterates over the results of a Splunk results or export stream requested with output_mode=json
+
+    The results endpoint returns one JSON document holding a page of results, the
+    export endpoint returns one JSON document per result, each on its own line.
+    Both are decoded line by line as the stream is read, so export results are
+    available as soon as they arrive. Messages sent by Splunk are collected in
+    messages, the field names in fields and is_preview tells whether the last
+    result read belongs to a preview.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.is_preview = None
+        self.fields = []
+        self.messages = []
+
+    def __iter__(self):
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        # Pieces of the line being read, joined once the end of the line shows up
+        pending = []
+
+        while True:
+            chunk = self._stream.read(self.CHUNK_SIZE)
+            if not chunk:
+                break
+
+            text = decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if '\n' not in text:
+                pending.append(text)
+                continue
+
+            lines = text.split('\n')
+            pending.append(lines[0])
+            lines[0] = ''.join(pending)
+            pending = [lines.pop()]
+
+            for line in lines:
+                for result in self._read_line(line):
+                    yield result
+
+        pending.append(decoder.decode(b'', final=True))
+        for result in self._read_line(''.join(pending)):
+            yield result
+
+    def _read_line(self, line):
+        line = line.strip()
+        if not line:
+            return
+
+        document = json.loads(line)
+
+        self.is_preview = document.get('preview', False)
+        self.messages.extend(document.get('messages', []))
+        if document.get('fields'):
+            self.fields = [field['name'] if isinstance(field, dict) else field for field in document['fields']]
+
+        if 'results' in document:
+            for result in document['results']:
+                yield result
+        elif 'result' in document:
+            yield document['result']
@@ -5,12 +5,32 @@
 # without a valid written license from Splunk Inc. is PROHIBITED.
 # --
 
+# Rows rendered in the results table, which pages through them in the browser
+PREVIEW_SIZE = 1000
+# Rows looked at to find the columns of the results table when no display fields are given
+HEADER_SAMPLE_SIZE = 100
+
+
+def _get_headers(param, data):
+    """Return the columns of the results table, from the display parameter or from a sample of the rows"""
+
+    if param.get("display"):
+        return [x.strip() for x in param['display'].split(',')]
+
+    headers = []
+    seen = set()
+    for item in data[:HEADER_SAMPLE_SIZE]:
+        for key in item.keys():
+            if key[0] != '_' and key not in seen:
+                seen.add(key)
+                headers.append(key)
+
+    return headers
+
 
 def _get_ctx_result(result, provides):
 
     ctx_result = {}
-    headers = []
-    processed_data = []
 
     param = result.get_param()
     summary = result.get_summary()
@@ -21,26 +41,14 @@ def _get_ctx_result(result, provides):
     if summary:
         ctx_result['summary'] = summary
 
+    ctx_result['total_rows'] = len(data)
     if not data:
-        ctx_result['data'] = {}
         return ctx_result
 
-    if param.get("display"):
-        headers = [x.strip() for x in param['display'].split(',')]
-
-    else:
-        for key in data[0].keys():
-            if key[0] != '_':
-                headers.append(key)
-
-    for item in data:
-        header_values = dict()
-        for header in headers:
-            header_values[header] = item.get(header)
-        processed_data.append(header_values)
+    headers = _get_headers(param, data)
 
-    ctx_result['data'] = data
-    ctx_result['processed_data'] = processed_data
+    # Only a preview of the rows is rendered, as lists of values in the order of the headers
+    ctx_result['rows'] = [[item.get(header) for header in headers] for item in data[:PREVIEW_SIZE]]
     ctx_result['headers'] = headers
 
     return ctx_result